@@ -90,6 +90,10 @@ class ParserError(Exception):
         self.message = message
         self.dump = dump
 
+    def __reduce__(self):
+        # Keep it picklable to return it from worker processes
+        return (ParserError, (self.message, self.dump))
+
 
 def thread(res: bytes) -> ParsedThread | ParserError:
     def game_has_prefixes(*names: list[str]):
@@ -224,27 +228,12 @@ def thread(res: bytes) -> ParsedThread | ParserError:
                 name += elem.text
         name = fixed_spaces(sanitize_whitespace(re.search(r"^\s*(.*?)(?:\s*\[.*?\]\s*)*$", name).group(1)))
 
-        thread_version = get_game_attr("version", "mod version", "game version")
+        thread_version = get_game_attr(*thread_version_attrs)
         if not thread_version:
             if match := re.search(r"(?:\[.+?\] - )*.+?\[(.+?)\]", html.title.text):
                 thread_version = fixed_spaces(sanitize_whitespace(match.group(1)))
 
-        developer = get_game_attr(
-            "developer/publisher",
-            "developer & publisher",
-            "developer / publisher",
-            "original developer",
-            "developers",
-            "developer",
-            "publisher",
-            "artist",
-            "animator",
-            "producer",
-            "modder",
-            "remake by",
-            "game by",
-            "posted by"
-        )
+        developer = get_game_attr(*developer_attrs)
         for separator in developer_chop_separators:
             developer = developer.split(separator)[0]
         while True:
@@ -257,82 +246,11 @@ def thread(res: bytes) -> ParsedThread | ParserError:
                 break
         developer = fixed_spaces(developer.strip(developer_strip_chars))
 
-        # Content Types
-        if game_has_prefixes("Cheat Mod"):
-            type = Type.Cheat_Mod
-        elif game_has_prefixes("Mod"):
-            type = Type.Mod
-        elif game_has_prefixes("Tool"):
-            type = Type.Tool
-        # Post Types
-        elif game_has_prefixes("READ ME"):
-            type = Type.READ_ME
-        elif game_has_prefixes("Request"):
-            type = Type.Request
-        elif game_has_prefixes("Tutorial"):
-            type = Type.Tutorial
-        # Media Types
-        elif game_has_prefixes("SiteRip"):
-            type = Type.SiteRip
-        elif game_has_prefixes("Collection"):
-            type = Type.Collection
-        elif game_has_prefixes("Manga"):
-            type = Type.Manga
-        elif game_has_prefixes("Comics"):
-            type = Type.Comics
-        elif game_has_prefixes("Video"):
-            type = Type.Video
-        elif game_has_prefixes("GIF"):
-            type = Type.GIF
-        elif game_has_prefixes("Pinup"):
-            type = Type.Pinup
-        elif game_has_prefixes("CG"):
-            type = Type.CG
-        # Game Engines
-        elif game_has_prefixes("ADRIFT"):
-            type = Type.ADRIFT
-        elif game_has_prefixes("Flash"):
-            type = Type.Flash
-        elif game_has_prefixes("Godot"):
-            type = Type.Godot
-        elif game_has_prefixes("HTML"):
-            type = Type.HTML
-        elif game_has_prefixes("Java"):
-            type = Type.Java
-        elif game_has_prefixes("Others"):
-            type = Type.Others
-        elif game_has_prefixes("QSP"):
-            type = Type.QSP
-        elif game_has_prefixes("RAGS"):
-            type = Type.RAGS
-        elif game_has_prefixes("RPGM"):
-            type = Type.RPGM
-        elif game_has_prefixes("Ren'Py"):
-            type = Type.RenPy
-        elif game_has_prefixes("Tads"):
-            type = Type.Tads
-        elif game_has_prefixes("Unity"):
-            type = Type.Unity
-        elif game_has_prefixes("Unreal Engine"):
-            type = Type.Unreal_Eng
-        elif game_has_prefixes("WebGL"):
-            type = Type.WebGL
-        elif game_has_prefixes("Wolf RPG"):
-            type = Type.Wolf_RPG
-        else:
-            type = Type.Misc
-
-        if game_has_prefixes("Completed"):
-            status = Status.Completed
-        elif game_has_prefixes("Onhold"):
-            status = Status.OnHold
-        elif game_has_prefixes("Abandoned"):
-            status = Status.Abandoned
-        else:
-            status = Status.Normal
+        type = next((type for prefix, type in type_prefixes if game_has_prefixes(prefix)), Type.Misc)
+        status = next((status for prefix, status in status_prefixes if game_has_prefixes(prefix)), Status.Normal)
 
         last_updated = 0
-        text = get_game_attr("thread updated", "updated", "release date").replace("/", "-")
+        text = get_game_attr(*last_updated_attrs).replace("/", "-")
         try:
             last_updated = dt.datetime.fromisoformat(text).timestamp()
         except ValueError:
@@ -376,8 +294,8 @@ def thread(res: bytes) -> ParsedThread | ParserError:
                     except Exception:
                         pass
 
-        description_html, description_regex = get_long_game_attr("overview", "story")
-        changelog_html, changelog_regex = get_long_game_attr("changelog", "change-log", "change log")
+        description_html, description_regex = get_long_game_attr(*description_attrs)
+        changelog_html, changelog_regex = get_long_game_attr(*changelog_attrs)
         if len(description_regex) > len(description_html):
             if description_html and description_regex in changelog_html + changelog_regex:
                 description = description_html
@@ -411,7 +329,7 @@ def thread(res: bytes) -> ParsedThread | ParserError:
         # FIXME: find preview images in thread
         previews_urls = []
 
-        downloads = get_game_downloads("downloads", "download")
+        downloads = get_game_downloads(*downloads_attrs)
 
     except Exception:
         e = ParserError(
@@ -525,6 +443,527 @@ developer_remove_patterns = [
     r"https?://\S*",
 ]
 
+# Attribute names and prefixes shared by both parsers, in the order they are tried
+thread_version_attrs = ("version", "mod version", "game version")
+developer_attrs = (
+    "developer/publisher",
+    "developer & publisher",
+    "developer / publisher",
+    "original developer",
+    "developers",
+    "developer",
+    "publisher",
+    "artist",
+    "animator",
+    "producer",
+    "modder",
+    "remake by",
+    "game by",
+    "posted by",
+)
+last_updated_attrs = ("thread updated", "updated", "release date")
+description_attrs = ("overview", "story")
+changelog_attrs = ("changelog", "change-log", "change log")
+downloads_attrs = ("downloads", "download")
+type_prefixes = (
+    # Content Types
+    ("Cheat Mod", Type.Cheat_Mod),
+    ("Mod", Type.Mod),
+    ("Tool", Type.Tool),
+    # Post Types
+    ("READ ME", Type.READ_ME),
+    ("Request", Type.Request),
+    ("Tutorial", Type.Tutorial),
+    # Media Types
+    ("SiteRip", Type.SiteRip),
+    ("Collection", Type.Collection),
+    ("Manga", Type.Manga),
+    ("Comics", Type.Comics),
+    ("Video", Type.Video),
+    ("GIF", Type.GIF),
+    ("Pinup", Type.Pinup),
+    ("CG", Type.CG),
+    # Game Engines
+    ("ADRIFT", Type.ADRIFT),
+    ("Flash", Type.Flash),
+    ("Godot", Type.Godot),
+    ("HTML", Type.HTML),
+    ("Java", Type.Java),
+    ("Others", Type.Others),
+    ("QSP", Type.QSP),
+    ("RAGS", Type.RAGS),
+    ("RPGM", Type.RPGM),
+    ("Ren'Py", Type.RenPy),
+    ("Tads", Type.Tads),
+    ("Unity", Type.Unity),
+    ("Unreal Engine", Type.Unreal_Eng),
+    ("WebGL", Type.WebGL),
+    ("Wolf RPG", Type.Wolf_RPG),
+)
+status_prefixes = (
+    ("Completed", Status.Completed),
+    ("Onhold", Status.OnHold),
+    ("Abandoned", Status.Abandoned),
+)
+
+
+# Fast thread parser, goes straight to lxml with regexes compiled once at import and
+# walks the first post a single time into a small node model that mimics the bs4 tree,
+# so thread_fast() can be diffed against thread() and must return the exact same data.
+# Experimental until parser-bench.py has real saved pages to prove that on
+
+# bs4 keeps strings inside these in their own type, excluded from the text of other tags
+string_containers = ("rt", "rp", "style", "script", "template")
+# Same as bs4.builder.LXMLTreeBuilder.CHUNK_SIZE
+fast_chunk_size = 512
+# Like bs4, blank strings outside of these collapse to a single newline or space
+preserve_whitespace_tags = ("pre", "textarea")
+fast_collapse_whitespace = lambda text: ("\n" if "\n" in text else " ") if not text.strip(" \n\t\f\r") else text
+
+fast_whitespace_regex = re.compile(r"(?:[^\S\r\n]|\u200b)")
+fast_newline_regex = re.compile(r" *(?:\r\n?|\n)")
+fast_newlines_regex = re.compile(r"(?: *\n){2}(?: *\n)+")
+fast_spaces_regex = re.compile(r" +")
+fast_sanitize_whitespace = lambda text: fast_newline_regex.sub("\n", fast_whitespace_regex.sub(" ", text))
+fast_fixed_newlines = lambda text: fast_newlines_regex.sub("\n\n", text).strip()
+fast_fixed_spaces = lambda text: fast_spaces_regex.sub(" ", text).strip()
+fast_clean_text = lambda text: fast_fixed_spaces(fast_fixed_newlines(fast_sanitize_whitespace(text)))
+
+game_attr_regexes = {
+    name: re.compile(r"^ *" + name + r" *(?: *\n? *:|: *\n? *) *(.*)", re.M | re.I)
+    for name in (*thread_version_attrs, *developer_attrs, *last_updated_attrs)
+}
+long_game_attr_regexes = {
+    name: re.compile(r"^ *" + name + r" *:? *\n? *:? *((?:.|\n)*)", re.M | re.I)
+    for name in (*description_attrs, *changelog_attrs)
+}
+long_game_attr_cut_regex = re.compile(r"(?:(?: *\n){7}|(?:\n *[A-Z a-z]+:(?:.|\n)+?){2}|\n *(?:DOWNLOAD|Download) *(?:\n|:))(?:.|\n)*", re.M)
+name_regex = re.compile(r"^\s*(.*?)(?:\s*\[.*?\]\s*)*$")
+title_version_regex = re.compile(r"(?:\[.+?\] - )*.+?\[(.+?)\]")
+developer_remove_regex = re.compile(r"(" + r"|".join(developer_remove_patterns) + r")", re.I)
+score_regex = re.compile(r"(\d(?:\.\d\d?)?)")
+votes_regex = re.compile(r"reviews\s*\(([\d,]+)\)", re.M | re.I)
+
+xpath_class = lambda name: f"contains(concat(' ', normalize-space(@class), ' '), ' {name} ')"
+xpath_first = lambda expr: etree.XPath(f"({expr})[1]")
+xpath_head = xpath_first(f"//*[{xpath_class('p-body-header')}]")
+xpath_post = xpath_first(f"//*[{xpath_class('message-threadStarterPost')}]")
+xpath_logo = xpath_first(f"//*[{xpath_class('p-header-logo')}]//img")
+xpath_title_value = xpath_first(f"//*[{xpath_class('p-title-value')}]")
+xpath_title = xpath_first("//title")
+xpath_tabs = xpath_first(f"//*[{xpath_class('tabs')}]")
+xpath_ldjsons = etree.XPath("//script[@type='application/ld+json']")
+xpath_head_spans = etree.XPath(".//span")
+xpath_head_rating = xpath_first(".//select[@name='rating']")
+xpath_head_bratr_rating = xpath_first(f".//*[{xpath_class('bratr-rating')}]")
+xpath_head_taglist = xpath_first(f".//*[{xpath_class('js-tagList')}]")
+
+
+class FastNode:
+    """Element or string of the first post, behaves like the bs4 node after thread() mutations"""
+    __slots__ = ("name", "attrs", "classes", "value", "kind", "parent", "children", "index", "_first", "_text")
+
+    def __init__(self, name: str | None, parent: "FastNode | None", value: str = "", kind: str | None = None):
+        self.name = name
+        self.attrs = {}
+        self.classes = ()
+        self.value = value
+        self.kind = kind
+        self.parent = parent
+        self.children = []
+        self.index = 0
+        self._first = None
+        self._text = None
+
+    @classmethod
+    def build(cls, elem: etree._Element, mutate=False, elements: list | None = None, parent=None, kind=None, preserve=False) -> "FastNode":
+        node = cls(elem.tag, parent)
+        node.attrs = dict(elem.attrib)
+        node.classes = node.attrs.get("class", "").split()
+        if elem.tag in string_containers:
+            kind = elem.tag
+        preserve = preserve or elem.tag in preserve_whitespace_tags
+        string = (lambda text: text) if preserve else fast_collapse_whitespace
+        if elements is not None and parent is not None:
+            elements.append(node)
+        children = node.children
+        if elem.text:
+            children.append(cls(None, node, string(elem.text), kind))
+        for child in elem:
+            if isinstance(child.tag, str):
+                children.append(cls.build(child, mutate, elements, node, kind, preserve))
+                if mutate and child.tag == "div":
+                    children.append(cls(None, node, "\n"))
+            else:
+                # Comments and processing instructions never count as text
+                children.append(cls(None, node, string(child.text or ""), "comment"))
+            if child.tail:
+                children.append(cls(None, node, string(child.tail), kind))
+        for i, child in enumerate(children):
+            child.index = i
+        if mutate and "bbCodeSpoiler-button" in node.classes:
+            try:
+                title = node.find(lambda elem: elem.name == "span").find(lambda elem: elem.name == "span")
+                replaced = title.children[0]
+                title.children[0] = cls(None, title, "")
+                if replaced.name == "div":
+                    del title.children[1]  # Its newline, added above
+                for i, child in enumerate(title.children):
+                    child.index = i
+                replaced.parent = None
+            except Exception:
+                pass
+        return node
+
+    def __bool__(self):
+        # Like bs4, empty strings are falsy
+        return self.name is not None or bool(self.value)
+
+    @property
+    def next_sibling(self) -> "FastNode | None":
+        if self.parent is None or self.index + 1 >= len(self.parent.children):
+            return None
+        return self.parent.children[self.index + 1]
+
+    @property
+    def text(self) -> str:
+        if self.name is None:
+            return self.value if self.kind is None else ""
+        return self.strings(self.name if self.name in string_containers else None)
+
+    @property
+    def first(self) -> str:
+        # First char of text, lowercased, enough to rule out most is_text() candidates
+        if self._first is None:
+            self._first = ""
+            for child in self.children:
+                if child.name is not None:
+                    char = child.first
+                elif child.kind is None:
+                    char = child.value[:1].lower()[:1]
+                else:
+                    continue
+                if char:
+                    self._first = char
+                    break
+        return self._first
+
+    def strings(self, kind: str | None) -> str:
+        if kind is None and self._text is not None:
+            return self._text
+        text = "".join(
+            child.value if child.name is None else child.strings(kind)
+            for child in self.children
+            if child.name is not None or child.kind == kind
+        )
+        if kind is None:
+            self._text = text
+        return text
+
+    def descendants(self):
+        for child in self.children:
+            yield child
+            if child.name is not None:
+                yield from child.descendants()
+
+    def find(self, match) -> "FastNode | None":
+        for elem in self.descendants():
+            if elem.name is not None and match(elem):
+                return elem
+        return None
+
+    def attached(self, root: "FastNode") -> bool:
+        elem = self
+        while elem.parent is not None:
+            elem = elem.parent
+        return elem is root
+
+
+def fast_string(elem: etree._Element) -> str | None:
+    # Same as bs4 Tag.string, follows single children down to a lone string
+    while True:
+        nodes = [elem.text] if elem.text else []
+        for child in elem:
+            nodes.append(child)
+            if child.tail:
+                nodes.append(child.tail)
+        if len(nodes) != 1:
+            return None
+        elem = nodes[0]
+        if isinstance(elem, str):
+            return elem
+        if not isinstance(elem.tag, str):
+            return elem.text
+
+
+def thread_fast(res: bytes) -> ParsedThread | ParserError:
+    def is_text(elem: FastNode, text: str):
+        if elem.name not in string_containers and elem.first != text[0]:
+            return False
+        val = fast_sanitize_whitespace(elem.text.lower())
+        return val == text or val.startswith(text + ":")
+    def find_text(*names: list[str]):
+        for name in names:
+            for elem in elements:
+                if is_text(elem, name) and elem.attached(post):
+                    return elem
+        return None
+    def find_class(name: str):
+        for elem in elements:
+            if name in elem.classes and elem.attached(post):
+                return elem
+        return None
+    def node(elem: etree._Element):
+        return FastNode.build(elem)
+    def get_game_attr(*names: list[str]):
+        for name in names:
+            if match := game_attr_regexes[name].search(plain):
+                return fast_fixed_spaces(match.group(1))
+        return ""
+    def get_long_game_attr(*names: list[str]):
+        value_regex = ""
+        for name in names:
+            if match := long_game_attr_regexes[name].search(plain):
+                value_regex = long_game_attr_cut_regex.sub("", match.group(1))
+                value_regex = fast_fixed_newlines(value_regex)
+        value_html = ""
+        if elem := find_text(*names):
+            while elem.children:
+                elem = elem.children[0]
+            while not ("bbWrapper" in elem.classes or elem.parent.name == "article"):
+                if elem.next_sibling:
+                    elem = elem.next_sibling
+                else:
+                    elem = elem.parent
+                    continue
+                if elem.name == "b" or (elem.name is not None and "center" in elem.attrs.get("style", "")):
+                    break
+                text = fast_sanitize_whitespace(elem.text)
+                if text.strip() in (":", ""):
+                    continue
+                value_html += text
+            value_html = fast_fixed_newlines(value_html)
+        return value_html, value_regex
+    def get_game_downloads(*names: list[str]):
+        if not (elem := find_text(*names)):
+            return []
+        while "link" not in elem.classes and elem.children:
+            elem = elem.children[0]
+        downloads = []
+        download_name = ""
+        download_mirrors = []
+        def add_downloads():
+            nonlocal download_name, download_mirrors
+            download_name = fast_clean_text(download_name)
+            lines = download_name.split("\n")
+            download_name = fast_clean_text(lines.pop()).strip(":")
+            while lines:
+                if line := fast_clean_text(lines.pop(0)).strip(":"):
+                    downloads.append((line, []))
+            if download_name or download_mirrors:
+                downloads.append((download_name, download_mirrors))
+                download_name = ""
+                download_mirrors = []
+        while not ("bbWrapper" in elem.classes or elem.parent.name == "article"):
+            if elem.next_sibling:
+                elem = elem.next_sibling
+            else:
+                elem = elem.parent
+                continue
+            while not (is_link := "link" in elem.classes) and elem.children:
+                elem = elem.children[0]
+            if is_link and (link_url := elem.attrs.get("href")):
+                if not link_url.startswith(f95_host):
+                    # Same XPath expressions as thread(), see there
+                    link_host = link_url[:link_url.find("/", len("https://")) + 1]
+                    xpath_expr = f"//{elem.name}[starts-with(@href,{link_host!r})]"
+                    xpath_results = post_elem.xpath("." + xpath_expr)
+                    for xpath_i, xpath_result in enumerate(xpath_results):
+                        if xpath_result.get("href") == link_url:
+                            link_url = f"{xpath_expr}[{xpath_i + 1}]"
+                            break
+                    else:  # Did not break so no match for some reason, just redact it
+                        link_url = ""
+                download_mirrors.append((fast_clean_text(elem.text), link_url))
+            else:
+                if elem.name in ("img", "video"):
+                    break
+                text = fast_sanitize_whitespace(elem.text)
+                if not text.strip("-,*:/ "):
+                    continue
+                if download_mirrors:
+                    add_downloads()
+                download_name += text
+        add_downloads()
+        downloads = tuple(downloads)
+        return downloads
+
+    try:
+
+        # Feed it like bs4 does, the push parser keeps blank text differently than a one shot parse
+        html_parser = etree.HTMLParser(encoding="utf-8")
+        for i in range(0, len(res), fast_chunk_size):
+            html_parser.feed(res[i:i + fast_chunk_size])
+        root = html_parser.close() if res else None
+        head = xpath_head(root) if root is not None else None
+        post = xpath_post(root) if root is not None else None
+        if not head or not post:
+            logo = xpath_logo(root) if root is not None else None
+            if logo and logo[0].get("alt", "").startswith("F95zone"):
+                e = ParserError(
+                    message="Thread structure missing",
+                    dump=res,
+                )
+            else:
+                e = ParserError(
+                    message="Not an F95zone payload",
+                    dump=res,
+                )
+            return e
+        head = head[0]
+        post_elem = post[0]
+        # The one walk over the post, applies the same spoiler and div tweaks as thread()
+        elements: list[FastNode] = []
+        post = FastNode.build(post_elem, mutate=True, elements=elements)
+        article = next((elem for elem in elements if elem.name == "article" and elem.attached(post)), None)
+        plain = fast_sanitize_whitespace(article.text)
+
+        name = ""
+        for elem in node(xpath_title_value(root)[0]).children:
+            if not ("labelLink" in elem.classes or "label-append" in elem.classes):
+                name += elem.text
+        name = fast_fixed_spaces(fast_sanitize_whitespace(name_regex.search(name).group(1)))
+
+        thread_version = get_game_attr(*thread_version_attrs)
+        if not thread_version:
+            if match := title_version_regex.search(node(xpath_title(root)[0]).text):
+                thread_version = fast_fixed_spaces(fast_sanitize_whitespace(match.group(1)))
+
+        developer = get_game_attr(*developer_attrs)
+        for separator in developer_chop_separators:
+            developer = developer.split(separator)[0]
+        while True:
+            prev_developer = developer
+            developer = developer_remove_regex.sub("", developer)
+            if not developer:
+                developer = prev_developer
+                break
+            if developer == prev_developer:
+                break
+        developer = fast_fixed_spaces(developer.strip(developer_strip_chars))
+
+        prefixes = set(fast_string(span) for span in xpath_head_spans(head))
+        type = next((type for prefix, type in type_prefixes if prefix in prefixes), Type.Misc)
+        status = next((status for prefix, status in status_prefixes if prefix in prefixes), Status.Normal)
+
+        last_updated = 0
+        text = get_game_attr(*last_updated_attrs).replace("/", "-")
+        try:
+            last_updated = dt.datetime.fromisoformat(text).timestamp()
+        except ValueError:
+            pass
+        if not last_updated:
+            try:
+                if elem := find_class("message-lastEdit"):
+                    last_updated = int(elem.find(lambda elem: elem.name == "time").attrs.get("data-time"))
+                else:
+                    last_updated = int(find_class("message-attribution-main").find(lambda elem: elem.name == "time").attrs.get("data-time"))
+            except Exception:
+                pass
+        last_updated = datestamp(last_updated)
+
+        score = None
+        votes = None
+        for ldjson in xpath_ldjsons(root):
+            try:
+                schema = json.loads(ldjson.text or "")
+                if schema["@context"] != "http://schema.org/" or "aggregateRating" not in schema:
+                    continue
+                score = float(schema["aggregateRating"]["ratingValue"])
+                votes = int(schema["aggregateRating"]["ratingCount"])
+                break
+            except Exception:
+                pass
+
+        if score is None:
+            score = 0.0
+            if elem := xpath_head_rating(head):
+                score = float(elem[0].get("data-initial-rating"))
+            elif elem := xpath_head_bratr_rating(head):
+                score = float(score_regex.search(elem[0].get("title")).group(1))
+
+        if votes is None:
+            votes = 0
+            if elem := xpath_tabs(root):
+                if match := votes_regex.search(node(elem[0]).text):
+                    try:
+                        votes = int(match.group(1).replace(",", ""))
+                    except Exception:
+                        pass
+
+        description_html, description_regex = get_long_game_attr(*description_attrs)
+        changelog_html, changelog_regex = get_long_game_attr(*changelog_attrs)
+        if len(description_regex) > len(description_html):
+            if description_html and description_regex in changelog_html + changelog_regex:
+                description = description_html
+            else:
+                description = description_regex
+        else:
+            if description_regex and description_html in changelog_html + changelog_regex:
+                description = description_regex
+            else:
+                description = description_html
+        changelog = changelog_regex if len(changelog_regex) > len(changelog_html) else changelog_html
+
+        tags = []
+        unknown_tags = []
+        if taglist := xpath_head_taglist(head):
+            for child in taglist[0]:
+                if isinstance(child.tag, str) and "/tags/" in (tag := child.get("href", "")):
+                    tag = tag.replace("/tags/", "").strip("/")
+                    if tag not in Tag._member_names_:
+                        unknown_tags.append(tag)
+                    else:
+                        tags.append(Tag[tag])
+        tags = tuple(sorted(tags, key=lambda tag: tag.name))
+
+        elem = find_class("bbWrapper").find(lambda elem: elem.name == "img" and "data-src" in elem.attrs)
+        if elem:
+            image_url = elem.attrs.get("data-src")
+        else:
+            image_url = "missing"
+
+        # FIXME: find preview images in thread
+        previews_urls = []
+
+        downloads = get_game_downloads(*downloads_attrs)
+
+    except Exception:
+        e = ParserError(
+            message=f"Unhandled exception: {error.text()}",
+            dump=error.traceback()
+        )
+        return e
+
+    ret = ParsedThread(
+        name=name,
+        thread_version=thread_version,
+        developer=developer,
+        type=type,
+        status=status,
+        last_updated=last_updated,
+        score=score,
+        votes=votes,
+        description=description,
+        changelog=changelog,
+        tags=tags,
+        unknown_tags=unknown_tags,
+        image_url=image_url,
+        previews_urls=previews_urls,
+        downloads=downloads,
+    )
+    return ret
+
 
 def reviews(res: bytes) -> ParsedReviews | ParserError:
     try:
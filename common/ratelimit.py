@@ -0,0 +1,73 @@
+import asyncio
+import time
+
+
+class AdaptiveRate:
+    """Additive increase, multiplicative decrease of a request rate, like TCP congestion control"""
+
+    def __init__(
+        self,
+        rate: float,
+        min_rate: float,
+        max_rate: float,
+        increase: float = 0.01,
+        decrease: float = 0.5,
+        hold: float = 2.0,
+    ):
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.hold = hold
+        self._held_until = 0.0
+
+    @property
+    def interval(self) -> float:
+        return 1 / self.rate
+
+    def succeeded(self) -> None:
+        # Probe for more throughput slowly while responses are clean
+        if time.monotonic() < self._held_until:
+            return
+        self.rate = min(self.rate + self.increase, self.max_rate)
+
+    def throttled(self) -> None:
+        # Requests already in flight went out at the old rate, only cut once for them
+        now = time.monotonic()
+        if now < self._held_until:
+            return
+        self.rate = max(self.rate * self.decrease, self.min_rate)
+        self._held_until = now + self.hold
+
+
+class AdaptiveLimiter:
+    """Replacement for aiolimiter.AsyncLimiter, spacing requests by an AdaptiveRate"""
+
+    def __init__(self, rate: AdaptiveRate):
+        self.rate = rate
+        self.waiting = 0
+        self._next_slot = 0.0
+
+    async def acquire(self) -> None:
+        now = time.monotonic()
+        slot = max(self._next_slot, now)
+        self._next_slot = slot + self.rate.interval
+        if slot > now:
+            self.waiting += 1
+            try:
+                await asyncio.sleep(slot - now)
+            finally:
+                self.waiting -= 1
+
+    def succeeded(self) -> None:
+        self.rate.succeeded()
+
+    def throttled(self) -> None:
+        self.rate.throttled()
+
+    async def __aenter__(self) -> None:
+        await self.acquire()
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        pass
@@ -815,12 +815,14 @@ class Settings:
     background_on_close         : bool
     bg_notifs_interval          : int
     bg_refresh_interval         : int
+    bg_stream_changes           : bool
     browser                     : Browser.get
     browser_custom_arguments    : str
     browser_custom_executable   : str
     browser_html                : bool
     browser_private             : bool
     cell_image_ratio            : float
+    changes_since               : int
     check_notifs                : bool
     compact_timeline            : bool
     confirm_on_remove           : bool
@@ -844,6 +846,7 @@ class Settings:
     independent_tab_views       : bool
     insecure_ssl                : bool
     interface_scaling           : float
+    last_full_refresh           : Timestamp
     last_successful_refresh     : Timestamp
     manual_sort_list            : list[int]
     mark_installed_after_add    : bool
@@ -949,6 +952,7 @@ class Game:
     added_on           : Datestamp
     last_updated       : Datestamp
     last_full_check    : int
+    last_full_check_etag: str
     last_check_version : str
     last_launched      : Datestamp
     score              : float
@@ -1133,6 +1137,7 @@ class Game:
             "added_on",
             "last_updated",
             "last_full_check",
+            "last_full_check_etag",
             "last_check_version",
             "last_launched",
             "score",
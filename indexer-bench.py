@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import pathlib
+import random
+import time
+
+import aiohttp
+import aiohttp.web
+import fastapi
+import redis.asyncio as aredis
+import uvicorn
+
+from indexer import (
+    admission,
+    cache,
+    codec,
+    f95zone,
+    metrics,
+    parsing,
+    refresher,
+    streams,
+    threads,
+    watcher,
+)
+
+# Load test for the indexer without touching F95zone: a local stand-in serves the
+# saved parser corpus pages, and clients hammer /fast and /full on a local server.
+# Compare runs with the same arguments before and after changes.
+corpus = pathlib.Path(__file__).parent / "bench/parser"
+
+
+def parse_args():
+    args = argparse.ArgumentParser(description="Offline indexer load test")
+    args.add_argument("--threads", type=int, default=300, help="thread IDs to simulate")
+    args.add_argument("--concurrency", type=int, default=32, help="concurrent clients")
+    args.add_argument("--duration", type=float, default=30, help="seconds of mixed traffic")
+    args.add_argument("--full-ratio", type=float, default=0.1, help="share of /full requests in mixed traffic")
+    args.add_argument("--fast-batch", type=int, default=100, help="IDs per /fast request")
+    args.add_argument("--latency", type=float, default=50, help="F95zone response latency in ms")
+    args.add_argument("--ratelimit-ratio", type=float, default=0.0, help="share of forum requests answered with 429")
+    args.add_argument("--rate", type=float, default=50, help="max F95zone requests per second for the indexer")
+    args.add_argument("--watcher-cycles", type=int, default=3, help="watcher poll cycles after the cold phase")
+    args.add_argument("--update-ratio", type=float, default=0.05, help="share of threads updated per watcher cycle")
+    args.add_argument("--redis", default="memory", help="'memory' (needs fakeredis) or a redis URL")
+    args.add_argument("--flush", action="store_true", help="flush the redis database first, never on a real indexer")
+    args.add_argument("--port", type=int, default=8169)
+    args.add_argument("--seed", type=int, default=0)
+    return args.parse_args()
+
+
+class FakeF95zone:
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        # Pages with the version their golden parses to, so records and pages agree
+        self.thread_pages = [
+            (page.read_bytes(), golden["thread_version"] or "1.0")
+            for page in sorted((corpus / "threads").rglob("*.html"))
+            if "error" not in (golden := json.loads(page.with_suffix(".json").read_text("utf-8")))
+        ]
+        self.review_pages = [
+            page.read_bytes()
+            for page in sorted((corpus / "reviews").rglob("*.html"))
+            if "error" not in json.loads(page.with_suffix(".json").read_text("utf-8"))
+        ]
+        now = int(time.time())
+        self.updates = {
+            id: {"version": self.thread_pages[id % len(self.thread_pages)][1], "ts": now - id * 600}
+            for id in range(1, args.threads + 1)
+        }
+        self.requests: dict[str, int] = {}
+
+    def update(self) -> list[int]:
+        # Some threads get a new version, like F95zone between watcher cycles
+        ids = random.sample(list(self.updates), int(len(self.updates) * self.args.update_ratio))
+        for id in ids:
+            _, original = self.thread_pages[id % len(self.thread_pages)]
+            bump = int(self.updates[id]["version"].removeprefix(original).lstrip(".") or 0) + 1
+            self.updates[id] = {"version": f"{original}.{bump}", "ts": int(time.time())}
+        return ids
+
+    def thread_page(self, id: int) -> bytes:
+        # Served page shows the same version as the records and version API
+        page, original = self.thread_pages[id % len(self.thread_pages)]
+        return page.replace(original.encode(), self.updates[id]["version"].encode())
+
+    def record(self, id: int) -> dict:
+        return {
+            "thread_id": id,
+            "title": f"Thread {id}",
+            "creator": "Developer",
+            "version": self.updates[id]["version"],
+            "prefixes": [],
+            "tags": [],
+            "rating": 4.2,
+            "cover": f"https://attachments.f95zone.to/{id}.jpg",
+            "screens": [],
+            "ts": self.updates[id]["ts"],
+        }
+
+    async def handle(self, request: aiohttp.web.Request) -> aiohttp.web.Response:
+        path = request.path
+        kind = (
+            "reviews" if path.endswith("/br-reviews/")
+            else "thread" if path.startswith("/threads/")
+            else path.rsplit("/", 1)[-1]
+        )
+        self.requests[kind] = self.requests.get(kind, 0) + 1
+        await asyncio.sleep(self.args.latency / 1000)
+
+        if kind in ("thread", "reviews"):
+            if random.random() < self.args.ratelimit_ratio:
+                return aiohttp.web.Response(status=429, body=b"<title>429 Too Many Requests</title>")
+            id = int(path.split("/")[2])
+            if kind == "reviews":
+                page = self.review_pages[id % len(self.review_pages)]
+            else:
+                page = self.thread_page(id)
+            return aiohttp.web.Response(body=page, content_type="text/html")
+
+        if kind == "checker.php":
+            ids = [int(id) for id in request.query["threads"].split(",")]
+            versions = {str(id): self.updates[id]["version"] for id in ids if id in self.updates}
+            return aiohttp.web.json_response({"status": "ok", "msg": versions})
+
+        # latest_data.php, searches only find the thread with the exact title
+        if "search" in request.query:
+            query = request.query["search"]
+            data = [self.record(id) for id in self.updates if f"Thread {id}" == query]
+        else:
+            page = int(request.query["page"])
+            rows = int(request.query["rows"])
+            ids = sorted(self.updates, key=lambda id: self.updates[id]["ts"], reverse=True)
+            data = [self.record(id) for id in ids[(page - 1) * rows : page * rows]]
+        return aiohttp.web.json_response({"status": "ok", "msg": {"data": data}})
+
+
+class RedisOps:
+    """Counts commands and round trips of every redis client in this process"""
+
+    def __init__(self):
+        self.commands = 0
+        self.round_trips = 0
+        execute_command = aredis.Redis.execute_command
+        execute = aredis.client.Pipeline.execute
+
+        async def counted_execute_command(client, *args, **options):
+            if not isinstance(client, aredis.client.Pipeline):
+                self.commands += 1
+                self.round_trips += 1
+            return await execute_command(client, *args, **options)
+
+        async def counted_execute(pipeline, *args, **kwargs):
+            self.commands += len(pipeline.command_stack)
+            self.round_trips += 1
+            return await execute(pipeline, *args, **kwargs)
+
+        aredis.Redis.execute_command = counted_execute_command
+        aredis.client.Pipeline.execute = counted_execute
+
+
+def scrapes() -> int:
+    return int(sum(sum(observations[:-1]) for observations in cache.SCRAPE_SECONDS.values.values()))
+
+
+def percentile(latencies: list[float], percent: float) -> float:
+    if not latencies:
+        return 0.0
+    return sorted(latencies)[round((len(latencies) - 1) * percent / 100)]
+
+
+@contextlib.asynccontextmanager
+async def phase(name: str, ops: RedisOps, results: list):
+    # Everything that happens inside counts towards this phase
+    stats = {"latencies": {}}
+    start = time.perf_counter()
+    start_scrapes = scrapes()
+    start_commands, start_round_trips = ops.commands, ops.round_trips
+    yield stats
+    # Stale threads are refreshed in background, let them finish
+    while refresher.pending:
+        await asyncio.sleep(0.1)
+    stats["seconds"] = time.perf_counter() - start
+    stats["scrapes"] = scrapes() - start_scrapes
+    stats["commands"] = ops.commands - start_commands
+    stats["round_trips"] = ops.round_trips - start_round_trips
+    results.append((name, stats))
+
+
+async def request(session: aiohttp.ClientSession, stats: dict, client: int, route: str, method: str, url: str, **kwargs):
+    start = time.perf_counter()
+    async with session.request(method, url, headers={"X-Bench-Client": str(client)}, **kwargs) as req:
+        await req.read()
+    if req.status == 429:
+        stats["rejected"] = stats.get("rejected", 0) + 1
+        return
+    stats["latencies"].setdefault(route, []).append(time.perf_counter() - start)
+
+
+async def run(args: argparse.Namespace):
+    random.seed(args.seed)
+    ops = RedisOps()
+    if args.redis == "memory":
+        import fakeredis.aioredis
+
+        redis_server = fakeredis.FakeServer()
+        aredis.Redis.from_url = staticmethod(
+            lambda url, **kwargs: fakeredis.aioredis.FakeRedis(server=redis_server, **kwargs)
+        )
+    else:
+        os.environ["REDIS_URL"] = args.redis
+    # Every simulated client gets its own token bucket and turn in the refresh queue
+    os.environ["CLIENT_IP_HEADER"] = "X-Bench-Client"
+
+    fake = FakeF95zone(args)
+    fake_app = aiohttp.web.Application()
+    fake_app.router.add_route("GET", "/{tail:.*}", fake.handle)
+    fake_runner = aiohttp.web.AppRunner(fake_app)
+    await fake_runner.setup()
+    await aiohttp.web.TCPSite(fake_runner, "127.0.0.1", args.port + 1).start()
+    host = f"http://127.0.0.1:{args.port + 1}"
+    f95zone.HOST = host
+    f95zone.THREAD_URL = f"{host}/threads/{{thread}}"
+    f95zone.BULK_VERSION_CHECK_URL = f"{host}/sam/checker.php?threads={{threads}}"
+    f95zone.LATEST_UPDATES_SEARCH_URL = f95zone.LATEST_UPDATES_SEARCH_URL.replace("https://f95zone.to", host)
+    f95zone.LATEST_UPDATES_URL = f95zone.LATEST_UPDATES_URL.replace("https://f95zone.to", host)
+    f95zone.RATELIMIT.rate.rate = f95zone.RATELIMIT.rate.max_rate = args.rate
+    # Version sweep covers every thread in one tick instead of spreading it over hours
+    watcher.WATCH_VERSIONS_INTERVAL = watcher.WATCH_VERSIONS_TICK
+
+    # Same as indexer-main, minus the background loops that would skew results
+    @contextlib.asynccontextmanager
+    async def lifespan(app: fastapi.FastAPI):
+        async with (
+            cache.lifespan(),
+            admission.lifespan(),
+            codec.lifespan(),
+            f95zone.lifespan(),
+            parsing.lifespan(),
+            refresher.lifespan(),
+            streams.lifespan(),
+        ):
+            if args.flush:
+                await cache.redis.flushdb()
+            yield
+
+    app = fastapi.FastAPI(lifespan=lifespan)
+    app.add_middleware(metrics.Middleware)
+    app.include_router(threads.router)
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=args.port, log_level="warning"))
+    server_task = asyncio.create_task(server.serve())
+    while not server.started:
+        if server_task.done():
+            return
+        await asyncio.sleep(0.05)
+
+    ids = list(fake.updates)
+    base = f"http://127.0.0.1:{args.port}"
+    results = []
+    connector = aiohttp.TCPConnector(limit=args.concurrency)
+    async with aiohttp.ClientSession(connector=connector) as session:
+
+        async with phase("watcher prime", ops, results):
+            await watcher.poll_updates()
+
+        async with phase("cold /full", ops, results) as stats:
+            queue = list(ids)
+
+            async def cold_client(client: int):
+                while queue:
+                    id = queue.pop()
+                    await request(session, stats, client, "/full", "GET", f"{base}/full/{id}?ts={int(time.time())}")
+
+            await asyncio.gather(*(cold_client(client) for client in range(args.concurrency)))
+
+        for cycle in range(args.watcher_cycles):
+            fake.update()
+            async with phase(f"watcher cycle {cycle + 1}", ops, results):
+                await watcher.poll_updates()
+
+        swept = fake.update()
+        async with phase("version sweep", ops, results):
+            await watcher.poll_versions()
+
+        async with phase("mixed", ops, results) as stats:
+            end = time.perf_counter() + args.duration
+
+            async def mixed_client(client: int):
+                while time.perf_counter() < end:
+                    if random.random() < args.full_ratio:
+                        id = random.choice(ids)
+                        await request(session, stats, client, "/full", "GET", f"{base}/full/{id}?ts={int(time.time())}")
+                    else:
+                        batch = random.sample(ids, min(args.fast_batch, len(ids)))
+                        await request(session, stats, client, "/fast", "POST", f"{base}/fast", json=batch)
+
+            await asyncio.gather(*(mixed_client(client) for client in range(args.concurrency)))
+
+    server.should_exit = True
+    await server_task
+    await fake_runner.cleanup()
+
+    print(f"{'phase':<18} {'route':<6} {'requests':>8} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'scrapes':>8} {'scrapes/s':>9} {'redis cmds':>10} {'round trips':>11} {'429s':>6}")
+    for name, stats in results:
+        routes = stats["latencies"] or {"-": []}
+        for route, latencies in routes.items():
+            print(
+                f"{name:<18} {route:<6} {len(latencies):>8} {len(latencies) / stats['seconds']:>8.1f}"
+                f" {percentile(latencies, 50) * 1000:>8.1f} {percentile(latencies, 99) * 1000:>8.1f}"
+                f" {stats['scrapes']:>8} {stats['scrapes'] / stats['seconds']:>9.2f}"
+                f" {stats['commands']:>10} {stats['round_trips']:>11} {stats.get('rejected', 0):>6}"
+            )
+    print()
+    print(f"Watcher invalidated: {dict((kind, int(count)) for (kind,), count in watcher.WATCH_INVALIDATED.values.items())}")
+    print(f"Version sweep invalidated {int(watcher.WATCH_INVALIDATED.values.get(('versions',), 0))} of {len(swept)} updated threads")
+    print(f"F95zone requests: {fake.requests}")
+    # Version lookups are batched, well below one per scrape when scrapes queue up
+    print(f"Version checks per scrape: {fake.requests.get('checker.php', 0) / (scrapes() or 1):.2f}")
+    print(f"F95zone ratelimit settled at {f95zone.RATELIMIT.rate.rate:.2f} requests/s")
+
+
+if __name__ == "__main__":
+    asyncio.run(run(parse_args()))
@@ -9,8 +9,15 @@ import fastapi
 import uvicorn
 
 from indexer import (
+    admission,
     cache,
+    codec,
+    evictor,
     f95zone,
+    metrics,
+    parsing,
+    refresher,
+    streams,
     threads,
     watcher,
 )
@@ -22,14 +29,23 @@ logger = logging.getLogger()
 async def lifespan(app: fastapi.FastAPI):
     async with (
         cache.lifespan(),
+        metrics.lifespan(),
+        admission.lifespan(),
+        codec.lifespan(),
         f95zone.lifespan(),
+        parsing.lifespan(),
+        refresher.lifespan(),
+        streams.lifespan(),
         watcher.lifespan(),
+        evictor.lifespan(),
     ):
         yield
 
 
 app = fastapi.FastAPI(lifespan=lifespan, docs_url=None, redoc_url=None)
+app.add_middleware(metrics.Middleware)
 app.include_router(threads.router)
+app.include_router(metrics.router)
 
 
 def main() -> None:
@@ -41,8 +57,9 @@ def main() -> None:
     uvicorn.run(
         "indexer-main:app",
         host=os.environ.get("BIND_HOST", "127.0.0.1"),
-        port=int(os.environ.get("BIND_HOST", 8069)),
-        workers=1,
+        port=int(os.environ.get("BIND_PORT", 8069)),
+        # Locks, ratelimit and watcher are shared through redis, so workers can scale
+        workers=int(os.environ.get("WORKERS", 1)),
         log_config=None,
         log_level=logging.INFO,
         access_log=False,
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+import asyncio
+import os
+
+import redis.asyncio as aredis
+
+from indexer import (
+    cache,
+    codec,
+)
+
+# Bytes taken by the large thread fields in redis, as stored now, fully
+# decompressed, and compressed like the codec would with the current dictionary.
+# Run with the same REDIS_URL as the indexer, works with compression off too.
+CHUNK_SIZE = 1000
+
+
+async def main():
+    cache.redis = aredis.Redis.from_url(
+        os.environ.get("REDIS_URL", "redis://localhost:6379"),
+        decode_responses=True,
+    )
+    await codec.load_dictionary()
+
+    totals = {key: (0, 0, 0, 0) for key in codec.CODEC_FIELDS}
+    threads = 0
+
+    async def report_chunk(names: list[str]):
+        values = cache.redis.pipeline()
+        for name in names:
+            values.hmget(name, codec.CODEC_FIELDS)
+        for fields in await values.execute():
+            fields = {key: value for key, value in zip(codec.CODEC_FIELDS, fields) if value}
+            stored = {key: len(value.encode()) for key, value in fields.items()}
+            for key, value in (await codec.decode(fields)).items():
+                raw = value.encode()
+                count, raw_size, stored_size, compressed_size = totals[key]
+                totals[key] = (
+                    count + 1,
+                    raw_size + len(raw),
+                    stored_size + stored[key],
+                    compressed_size + (
+                        min(len(raw), len(codec.compress(raw)))
+                        if len(raw) >= codec.CODEC_MIN_SIZE
+                        else len(raw)
+                    ),
+                )
+
+    names = []
+    async for name in cache.redis.scan_iter("thread:*", 10000, "hash"):
+        names.append(name)
+        threads += 1
+        if len(names) >= CHUNK_SIZE:
+            await report_chunk(names)
+            names = []
+    if names:
+        await report_chunk(names)
+    await cache.redis.aclose()
+
+    mib = lambda size: size / 1024 / 1024
+    print(f"{threads} threads, dictionary {codec.dictionary_id}")
+    print(f"{'field':<12} {'values':>8} {'raw MiB':>10} {'stored MiB':>11} {'saved':>7} {'codec MiB':>10} {'saved':>7}")
+    for key, (count, raw_size, stored_size, compressed_size) in totals.items():
+        print(
+            f"{key:<12} {count:>8} {mib(raw_size):>10.2f} {mib(stored_size):>11.2f}"
+            f" {1 - stored_size / (raw_size or 1):>7.1%}"
+            f" {mib(compressed_size):>10.2f} {1 - compressed_size / (raw_size or 1):>7.1%}"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,203 @@
+import contextlib
+import datetime as dt
+import ipaddress
+import logging
+import math
+import os
+import time
+import uuid
+
+import fastapi
+
+from indexer import (
+    cache,
+    metrics,
+    refresher,
+)
+
+ADMISSION_NAME_FORMAT = "admission:{client}"
+ADMISSION_RATE = 20  # Tokens per second per client
+ADMISSION_BURST = 1000  # Enough for a large library to fast check and full check a bunch at once
+ADMISSION_RETRY_MESSAGE = "Too many requests"
+ADMISSION_STREAMS_NAME_FORMAT = "admission:{client}:streams"
+ADMISSION_MAX_STREAMS = 4  # Open /subscribe streams per client, across all workers
+ADMISSION_STREAM_TTL = dt.timedelta(minutes=2).total_seconds()  # Frees slots of crashed workers
+
+# Token bucket per client, refilled by elapsed redis time so all workers agree.
+# Takes the cost if there are enough tokens and returns 0, else seconds to wait
+BUCKET_SCRIPT = """
+local time = redis.call("TIME")
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local bucket = redis.call("HMGET", KEYS[1], "tokens", "ts")
+local tokens = tonumber(bucket[1]) or burst
+local ts = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + (now - ts) * rate)
+local wait = 0
+if tokens < cost then
+    wait = (cost - tokens) / rate
+else
+    tokens = tokens - cost
+end
+redis.call("HSET", KEYS[1], "tokens", tostring(tokens), "ts", tostring(now))
+redis.call("EXPIRE", KEYS[1], math.ceil(burst / rate) + 1)
+return tostring(wait)
+"""
+
+# Set of open streams per client, scored by when they expire unless refreshed.
+# Adds or refreshes the stream if it is open or under the limit, returns 1 if it did
+STREAMS_SCRIPT = """
+local time = redis.call("TIME")
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local max = tonumber(ARGV[2])
+local ttl = tonumber(ARGV[3])
+redis.call("ZREMRANGEBYSCORE", KEYS[1], "-inf", now)
+if not redis.call("ZSCORE", KEYS[1], ARGV[1]) and redis.call("ZCARD", KEYS[1]) >= max then
+    return 0
+end
+redis.call("ZADD", KEYS[1], now + ttl, ARGV[1])
+redis.call("EXPIRE", KEYS[1], math.ceil(ttl))
+return 1
+"""
+
+logger = logging.getLogger(__name__)
+rate: float = 0
+burst: float = 0
+max_streams: int = 0
+client_header: str = ""
+by_peer: bool = False
+proxy_warned = False
+bucket_script = None
+streams_script = None
+
+ADMISSION_REJECTED = metrics.Counter(
+    "indexer_admission_rejected",
+    "Requests rejected with 429 because the client ran out of tokens",
+    labels=("route",),
+)
+ADMISSION_STREAMS_REJECTED = metrics.Counter(
+    "indexer_admission_streams_rejected",
+    "Streams rejected with 429 because the client has too many open",
+)
+
+
+@contextlib.asynccontextmanager
+async def lifespan():
+    global rate, burst, max_streams, client_header, by_peer
+    rate = float(os.environ.get("CLIENT_RATE", ADMISSION_RATE))
+    burst = float(os.environ.get("CLIENT_BURST", ADMISSION_BURST))
+    max_streams = int(os.environ.get("CLIENT_MAX_STREAMS", ADMISSION_MAX_STREAMS))
+    # Behind a proxy every request comes from the same address, e.g. CF-Connecting-IP
+    client_header = os.environ.get("CLIENT_IP_HEADER", "")
+    # Exposed directly, the connection's own address is the client
+    by_peer = os.environ.get("CLIENT_LIMIT_BY_PEER", "1") == "1"
+    if (rate or max_streams) and not client_header and not by_peer:
+        # Everyone would share the proxy's bucket, one busy client would lock out the rest
+        logger.warning("Neither CLIENT_IP_HEADER nor CLIENT_LIMIT_BY_PEER set, not limiting clients")
+        rate = 0
+        max_streams = 0
+    if rate:
+        logger.info(f"Limiting clients to {rate:g} tokens/s, bursts of {burst:g}")
+    if max_streams:
+        logger.info(f"Limiting clients to {max_streams} open streams")
+
+    yield
+
+
+def client(request: fastapi.Request) -> str:
+    global proxy_warned
+    if client_header and (address := request.headers.get(client_header)):
+        # Proxies append the address they saw, anything before it is whatever the client sent
+        return address.split(",")[-1].strip()
+    host = request.client.host if request.client else "unknown"
+    if by_peer and not client_header and not proxy_warned:
+        with contextlib.suppress(ValueError):
+            if ipaddress.ip_address(host).is_private:
+                proxy_warned = True
+                logger.warning(
+                    f"Limiting clients by address but requests come from {host},"
+                    " set CLIENT_IP_HEADER if the indexer is behind a proxy"
+                )
+    return host
+
+
+async def admit(request: fastapi.Request, cost: float = 1) -> fastapi.responses.Response | None:
+    global bucket_script
+    # Scrapes queued by this request are scheduled fairly against other clients
+    key = client(request)
+    refresher.client.set(key)
+    if not rate:
+        return None
+
+    if bucket_script is None or bucket_script.registered_client is not cache.redis:
+        bucket_script = cache.redis.register_script(BUCKET_SCRIPT)
+    wait = float(
+        await bucket_script(
+            keys=[ADMISSION_NAME_FORMAT.format(client=key)],
+            args=[rate, burst, min(cost, burst)],
+        )
+    )
+    if not wait:
+        return None
+
+    route = request.scope.get("route")
+    ADMISSION_REJECTED.inc(route=route.path if route else "other")
+    retry_after = math.ceil(wait)
+    return fastapi.responses.JSONResponse(
+        f"{ADMISSION_RETRY_MESSAGE}, retry in {retry_after}s",
+        status_code=429,
+        headers={"Retry-After": str(retry_after)},
+    )
+
+
+class StreamSlot:
+    """Counts an open stream against its client, held by refreshing until released"""
+
+    def __init__(self, request: fastapi.Request):
+        self.key = ADMISSION_STREAMS_NAME_FORMAT.format(client=client(request))
+        self.token = uuid.uuid4().hex
+        self.refreshed = 0.0
+        self.held = False
+
+    async def _hold(self) -> bool:
+        global streams_script
+        if streams_script is None or streams_script.registered_client is not cache.redis:
+            streams_script = cache.redis.register_script(STREAMS_SCRIPT)
+        self.refreshed = time.monotonic()
+        return bool(
+            await streams_script(
+                keys=[self.key],
+                args=[self.token, max_streams, ADMISSION_STREAM_TTL],
+            )
+        )
+
+    async def acquire(self) -> fastapi.responses.Response | None:
+        if not max_streams:
+            return None
+        if await self._hold():
+            self.held = True
+            return None
+
+        ADMISSION_STREAMS_REJECTED.inc()
+        retry_after = math.ceil(ADMISSION_STREAM_TTL)
+        return fastapi.responses.JSONResponse(
+            f"Max {max_streams} open streams, retry in {retry_after}s",
+            status_code=429,
+            headers={"Retry-After": str(retry_after)},
+        )
+
+    async def refresh(self) -> None:
+        # Cheap to call often, only reaches redis a few times per TTL
+        if self.held and time.monotonic() - self.refreshed >= ADMISSION_STREAM_TTL / 3:
+            await self._hold()
+
+    async def release(self) -> None:
+        if not self.held:
+            return
+        self.held = False
+        try:
+            await cache.redis.zrem(self.key, self.token)
+        except Exception:
+            logger.warning(f"Releasing stream slot failed, it expires in {ADMISSION_STREAM_TTL:g}s")
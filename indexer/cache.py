@@ -1,7 +1,11 @@
 import asyncio
 import contextlib
 import datetime as dt
+import hashlib
+import json
 import logging
+import os
+import random
 import time
 
 import redis.asyncio as aredis
@@ -12,12 +16,17 @@ from common import (
 )
 from external import error
 from indexer import (
+    codec,
     f95zone,
+    metrics,
+    refresher,
     scraper,
 )
 
 CACHE_TTL = dt.timedelta(days=7).total_seconds()
 SHORT_TTL = dt.timedelta(days=2).total_seconds()
+# Up to this much shorter, so threads cached together don't all expire together
+CACHE_TTL_JITTER = 0.1
 LAST_CHANGE_ELIGIBLE_FIELDS = (
     "name",
     "version",
@@ -38,11 +47,57 @@ LAST_CHANGE_ELIGIBLE_FIELDS = (
     "reviews",
     "INDEX_ERROR",
 )
+JSON_FIELDS = (
+    "tags",
+    "unknown_tags",
+    "previews_urls",
+    "downloads",
+    "reviews",
+)
+
+# Heavy fields dropped when evicting cold threads, the rest is kept to answer cheaply
+EVICTED_FIELDS = (
+    "description",
+    "changelog",
+    "tags",
+    "unknown_tags",
+    "previews_urls",
+    "downloads",
+    "reviews",
+)
 
 logger = logging.getLogger(__name__)
 redis: aredis.Redis = None
+serve_stale: bool = None
 locks_lock = asyncio.Lock()
 locks: dict[asyncio.Lock] = {}
+accessed: dict[int, float] = {}
+
+CACHE_LOOKUPS = metrics.Counter(
+    "indexer_cache_lookups",
+    "Thread lookups by cache state: fresh, stale (served expired) or missing (waited for refresh)",
+    labels=("state",),
+)
+CACHE_UPDATES = metrics.Counter(
+    "indexer_cache_updates",
+    "Thread cache updates by result: changed, unchanged or the index error flag",
+    labels=("result",),
+)
+SCRAPE_SECONDS = metrics.Histogram(
+    "indexer_scrape_seconds",
+    "Time spent scraping a thread from F95zone, including ratelimit waits",
+    buckets=(0.5, 1, 2.5, 5, 10, 30, 60, 120, 300),
+)
+CACHE_THREADS = metrics.Gauge(
+    "indexer_cache_threads",
+    "Cached threads by index error flag, refreshed every few minutes",
+    labels=("error",),
+)
+CACHE_EXPIRING = metrics.Gauge(
+    "indexer_cache_expiring",
+    "Cached threads by time left until they expire, up to each bucket from the previous one",
+    labels=("within",),
+)
 
 LAST_CACHED = "LAST_CACHED"
 EXPIRE_TIME = "EXPIRE_TIME"
@@ -51,14 +106,49 @@ INTERNAL_KEYWORDS = (
     CACHED_WITH := "CACHED_WITH",
     LAST_CHANGE := "LAST_CHANGE",
     HASHED_META := "HASHED_META",
+    EVICTED := "EVICTED",
 )
 NAME_FORMAT = "thread:{id}"
+# Compact latest updates records kept by watcher, so scraper can skip searching
+LATEST_NAME_FORMAT = "latest:{id}"
+LATEST_FIELDS = ("title", "creator", "prefixes", "tags", "rating", "cover", "screens", "ts")
+LATEST_TTL = dt.timedelta(days=1).total_seconds()
+# Reviews cached apart from threads, refetched when the review count changes
+REVIEWS_NAME_FORMAT = "reviews:{id}"
+REVIEWS_TTL = dt.timedelta(days=14).total_seconds()
+LOCK_NAME_FORMAT = "lock:thread:{id}"
+# Sorted sets of thread IDs, scored by ID, expire time and last change
+INDEX_IDS = "index:ids"
+INDEX_EXPIRE = "index:expire"
+INDEX_LAST_CHANGE = "index:last_change"
+INDEX_ACCESS = "index:access"
+ACCESS_RESOLUTION = dt.timedelta(hours=1).total_seconds()
+INDEX_BACKFILLED = "index:backfilled"
+INDEX_BACKFILL_CHUNK_SIZE = 1000
+INDEX_BACKFILL_TIMEOUT = dt.timedelta(minutes=30).total_seconds()
+# Pub/sub channel with "id:last_change" messages for the change stream
+CHANGES_CHANNEL = "changes"
+LOCK_TIMEOUT = dt.timedelta(minutes=5).total_seconds()
+LOCK_SLEEP = 0.25
+SUMMARY_INTERVAL = dt.timedelta(minutes=5).total_seconds()
+SUMMARY_EXPIRE_BUCKETS = (
+    ("1h", dt.timedelta(hours=1).total_seconds()),
+    ("1d", dt.timedelta(days=1).total_seconds()),
+    ("2d", dt.timedelta(days=2).total_seconds()),
+    ("7d", dt.timedelta(days=7).total_seconds()),
+    ("14d", dt.timedelta(days=14).total_seconds()),
+)
 
 
 @contextlib.asynccontextmanager
 async def lifespan():
-    global redis
-    redis = aredis.Redis(decode_responses=True)
+    global redis, serve_stale
+    redis = aredis.Redis.from_url(
+        os.environ.get("REDIS_URL", "redis://localhost:6379"),
+        decode_responses=True,
+    )
+    # Serve expired data right away and let refresher update it in background
+    serve_stale = os.environ.get("CACHE_SERVE_STALE", "1") == "1"
 
     retries = 7
     while retries:
@@ -71,45 +161,210 @@ async def lifespan():
                 raise
             await asyncio.sleep(5)
 
+    backfill_task = asyncio.create_task(backfill_indexes())
+
     try:
         yield
     finally:
+        backfill_task.cancel()
         await redis.aclose()
         redis = None
 
 
+async def backfill_indexes():
+    # Threads cached before the indexes existed, done once per redis
+    try:
+        if await redis.exists(INDEX_BACKFILLED):
+            return
+        async with shared_lock(f"lock:{INDEX_BACKFILLED}", INDEX_BACKFILL_TIMEOUT):
+            if await redis.exists(INDEX_BACKFILLED):
+                return
+            logger.info("Backfilling indexes")
+            backfilled = 0
+            names = []
+            async for name in redis.scan_iter("thread:*", 10000, "hash"):
+                names.append(name)
+                if len(names) >= INDEX_BACKFILL_CHUNK_SIZE:
+                    backfilled += await _backfill_indexes_chunk(names)
+                    names = []
+            if names:
+                backfilled += await _backfill_indexes_chunk(names)
+            await redis.set(INDEX_BACKFILLED, int(time.time()))
+            logger.info(f"Backfilled indexes for {backfilled} threads")
+    except Exception:
+        logger.error(f"Error backfilling indexes: {error.text()}\n{error.traceback()}")
+
+
+async def _backfill_indexes_chunk(names: list[str]) -> int:
+    cached_data = redis.pipeline()
+    for name in names:
+        cached_data.hmget(name, (LAST_CACHED, EXPIRE_TIME, LAST_CHANGE))
+    cached_data = await cached_data.execute()
+
+    indexes = redis.pipeline()
+    for name, (last_cached, expire_time, last_change) in zip(names, cached_data):
+        id = int(name.split(":")[1])
+        if last_cached and not expire_time:
+            expire_time = int(last_cached) + CACHE_TTL
+        # NX so threads updated meanwhile keep their newer scores
+        indexes.zadd(INDEX_IDS, {id: id}, nx=True)
+        indexes.zadd(INDEX_EXPIRE, {id: int(expire_time or 0)}, nx=True)
+        if last_change:
+            indexes.zadd(INDEX_LAST_CHANGE, {id: int(last_change)}, nx=True)
+    await indexes.execute()
+    return len(names)
+
+
+def invalidate(pipeline: aredis.client.Pipeline, id: int) -> None:
+    # Refresh on next request, and let the expire index know too
+    pipeline.hdel(NAME_FORMAT.format(id=id), LAST_CACHED)
+    pipeline.zadd(INDEX_EXPIRE, {id: 0})
+
+
+async def record_access(ids: list[int]) -> None:
+    # Coarse resolution, hot threads don't need a write on every request
+    now = time.time()
+    due = {id: int(now) for id in ids if now - accessed.get(id, 0) >= ACCESS_RESOLUTION}
+    if due:
+        accessed.update(due)
+        await redis.zadd(INDEX_ACCESS, due)
+
+
+def evicted_digest(fields: dict[str, str]) -> str:
+    # Lets a refresh tell if the dropped fields changed without keeping them around
+    return hashlib.md5(
+        json.dumps([fields.get(key) for key in EVICTED_FIELDS]).encode()
+    ).hexdigest()
+
+
+def meta_digest(update: dict) -> str:
+    # Latest updates details not saved as they are, only to discover metadata changes sooner
+    return hashlib.md5(
+        json.dumps(
+            (
+                update["title"],
+                update["creator"],
+                update["prefixes"],
+                update["tags"],
+                round(update["rating"], 1),
+                update["cover"],
+                update["screens"],
+                parser.datestamp(update["ts"]),
+            )
+        ).encode()
+    ).hexdigest()
+
+
 # https://stackoverflow.com/a/67057328
 @contextlib.asynccontextmanager
 async def lock(id: int):
     async with locks_lock:
         if not locks.get(id):
             locks[id] = asyncio.Lock()
-    async with locks[id]:
+    # Local lock first so waiters in this process don't all poll redis
+    async with locks[id], shared_lock(LOCK_NAME_FORMAT.format(id=id)):
         yield
     async with locks_lock:
         if (lock := locks.get(id)) and not lock.locked() and not lock._waiters:
             del locks[id]
 
 
+@contextlib.asynccontextmanager
+async def shared_lock(name: str, timeout: float = LOCK_TIMEOUT):
+    # Held across all workers and hosts using this redis
+    lock = redis.lock(
+        name,
+        timeout=timeout,
+        sleep=LOCK_SLEEP,
+        thread_local=False,
+    )
+    await lock.acquire()
+    # Scrapes can outlast the timeout when ratelimited, keep it alive while held
+    # so another worker doesn't take over, but still let it expire if this one dies
+    extend_task = asyncio.create_task(_extend_lock(lock, timeout))
+    try:
+        yield
+    finally:
+        extend_task.cancel()
+        await asyncio.gather(extend_task, return_exceptions=True)
+        try:
+            await lock.release()
+        except aredis.lock.LockError:
+            logger.warning(f"Lock {name} expired before being released")
+
+
+async def _extend_lock(lock: aredis.lock.Lock, timeout: float) -> None:
+    while True:
+        await asyncio.sleep(timeout / 3)
+        try:
+            await lock.reacquire()
+        except aredis.lock.LockError:
+            logger.warning(f"Lock {lock.name} expired while held")
+            return
+
+
 async def last_change(id: int) -> int:
     assert isinstance(id, int)
     name = NAME_FORMAT.format(id=id)
     logger.debug(f"Last change {name}")
 
+    await record_access([id])
     await _maybe_update_thread_cache(id, name)
 
     last_change = await redis.hget(name, LAST_CHANGE) or 0
     return int(last_change)
 
 
+async def last_changes(ids: list[int]) -> tuple[dict[int, int], set[int]]:
+    assert all(isinstance(id, int) for id in ids)
+    names = {id: NAME_FORMAT.format(id=id) for id in ids}
+    logger.debug(f"Last changes for {len(names)} threads")
+
+    await record_access(ids)
+
+    # Check all threads without locks in a single round trip
+    cached_data = redis.pipeline()
+    for name in names.values():
+        cached_data.hmget(name, (LAST_CACHED, EXPIRE_TIME, LAST_CHANGE))
+    cached_data = await cached_data.execute()
+
+    results = {}
+    stale = set()
+    missing = []
+    for id, (last_cached, expire_time, last_change) in zip(names, cached_data):
+        results[id] = int(last_change or 0)
+        if not _is_outdated(last_cached, expire_time):
+            continue
+        if serve_stale and last_change:
+            refresher.enqueue(id, refresher.PRIORITY_STALE)
+            stale.add(id)
+        else:
+            missing.append(id)
+    CACHE_LOOKUPS.inc(len(ids) - len(stale) - len(missing), state="fresh")
+    CACHE_LOOKUPS.inc(len(stale), state="stale")
+    CACHE_LOOKUPS.inc(len(missing), state="missing")
+
+    # Only wait for the threads that have nothing to serve yet
+    if missing:
+        await asyncio.gather(*(refresher.refresh(id) for id in missing))
+        updated_data = redis.pipeline()
+        for id in missing:
+            updated_data.hget(names[id], LAST_CHANGE)
+        for id, last_change in zip(missing, await updated_data.execute()):
+            results[id] = int(last_change or 0)
+
+    return results, stale
+
+
 async def get_thread(id: int) -> dict[str, str]:
     assert isinstance(id, int)
     name = NAME_FORMAT.format(id=id)
     logger.debug(f"Get {name}")
 
-    await _maybe_update_thread_cache(id, name)
+    await record_access([id])
+    await _maybe_update_thread_cache(id, name, full=True)
 
-    thread = await redis.hgetall(name)
+    thread = await codec.decode(await redis.hgetall(name))
 
     # Remove internal fields from response
     for key in INTERNAL_KEYWORDS:
@@ -118,22 +373,72 @@ async def get_thread(id: int) -> dict[str, str]:
     return thread
 
 
-async def _is_thread_cache_outdated(id: int, name: str) -> bool:
-    last_cached, expire_time = await redis.hmget(name, (LAST_CACHED, EXPIRE_TIME))
+async def changes_since(since: int, limit: int) -> tuple[dict[int, int], int | None]:
+    # Pages never split threads with the same last change, so the cursor is just
+    # the last score returned and threads that change while paging can't be skipped
+    changes = await redis.zrangebyscore(
+        INDEX_LAST_CHANGE, f"({since}", "+inf", start=0, num=limit, withscores=True
+    )
+    results = {int(id): int(last_change) for id, last_change in changes}
+
+    if len(changes) < limit:
+        return results, None
+    # Page ends inside a run of equal scores, include the rest of that run too
+    last_score = int(changes[-1][1])
+    ties = await redis.zrangebyscore(INDEX_LAST_CHANGE, last_score, last_score)
+    results.update((int(id), last_score) for id in ties)
+    return results, last_score
+
+
+def _jittered(ttl: float) -> float:
+    return ttl * (1 - random.random() * CACHE_TTL_JITTER)
+
+
+def _is_outdated(last_cached: str | None, expire_time: str | None, ahead: float = 0) -> bool:
     if last_cached and not expire_time:
         expire_time = int(last_cached) + CACHE_TTL
-    # Never cached or cache expired
-    return not last_cached or time.time() >= int(expire_time)
+    # Never cached or cache expired (or will within ahead seconds)
+    return not last_cached or time.time() + ahead >= int(expire_time)
+
+
+async def _is_thread_cache_outdated(id: int, name: str, ahead: float = 0) -> bool:
+    last_cached, expire_time = await redis.hmget(name, (LAST_CACHED, EXPIRE_TIME))
+    return _is_outdated(last_cached, expire_time, ahead)
 
 
-async def _maybe_update_thread_cache(id: int, name: str) -> None:
+def is_stale(thread: dict[str, str]) -> bool:
+    return _is_outdated(thread.get(LAST_CACHED), thread.get(EXPIRE_TIME))
+
+
+async def refresh_thread(id: int, ahead: float = 0) -> None:
+    await _locked_update_thread_cache(id, NAME_FORMAT.format(id=id), ahead)
+
+
+async def _maybe_update_thread_cache(id: int, name: str, full: bool = False) -> None:
     # Check without lock first to avoid bottlenecks
-    if not await _is_thread_cache_outdated(id, name):
+    last_cached, expire_time, last_change, evicted = await redis.hmget(
+        name, (LAST_CACHED, EXPIRE_TIME, LAST_CHANGE, EVICTED)
+    )
+    if not _is_outdated(last_cached, expire_time):
+        CACHE_LOOKUPS.inc(state="fresh")
+        return
+
+    # Evicted threads only have enough left for last change requests
+    if serve_stale and last_change and not (full and evicted):
+        # Was cached before, serve that and let refresher update it
+        CACHE_LOOKUPS.inc(state="stale")
+        refresher.enqueue(id, refresher.PRIORITY_STALE)
         return
 
+    # Nothing usable cached, wait for refresher to update it
+    CACHE_LOOKUPS.inc(state="missing")
+    await refresher.refresh(id)
+
+
+async def _locked_update_thread_cache(id: int, name: str, ahead: float = 0) -> None:
     # If it might be outdated, check with lock to avoid multiple updates
     async with lock(id):
-        if await _is_thread_cache_outdated(id, name):
+        if await _is_thread_cache_outdated(id, name, ahead):
             await _update_thread_cache(id, name)
 
 
@@ -141,35 +446,37 @@ async def _update_thread_cache(id: int, name: str) -> None:
     logger.info(f"Update cached {name}")
 
     try:
-        result = await scraper.thread(id)
+        with SCRAPE_SECONDS.time():
+            result = await scraper.thread(id)
     except Exception:
         logger.error(f"Exception caching {name}: {error.text()}\n{error.traceback()}")
         result = f95zone.ERROR_INTERNAL_ERROR
-    old_fields = await redis.hgetall(name)
+    old_fields = await codec.decode(await redis.hgetall(name))
     now = time.time()
 
     if isinstance(result, f95zone.IndexerError):
         # Something went wrong, keep cache and retry sooner/later
         new_fields = {
             INDEX_ERROR: result.error_flag,
-            EXPIRE_TIME: int(now + result.retry_delay),
+            EXPIRE_TIME: int(now + _jittered(result.retry_delay)),
         }
         if result.details:
             new_fields[INDEX_ERROR] += f": {result.details}"
         # Consider new error as a change
         if old_fields.get(INDEX_ERROR) != new_fields.get(INDEX_ERROR):
             new_fields[LAST_CHANGE] = int(now)
+        CACHE_UPDATES.inc(result=result.error_flag)
     else:
         # F95zone responded, cache new thread data
         new_fields = {
             **result,
             INDEX_ERROR: "",
-            EXPIRE_TIME: int(now + CACHE_TTL),
+            EXPIRE_TIME: int(now + _jittered(CACHE_TTL)),
         }
         # Recache more often if using thread_version
         if "thread_version" in new_fields:
             del new_fields["thread_version"]
-            new_fields[EXPIRE_TIME] = int(now + SHORT_TTL)
+            new_fields[EXPIRE_TIME] = int(now + _jittered(SHORT_TTL))
         # Special treatment for the almighty sacred last updated date
         if (
             new_fields.get("version")
@@ -184,6 +491,11 @@ async def _update_thread_cache(id: int, name: str) -> None:
         else:
             # Not previously cached, use date from thread / latest updates
             pass
+        # Evicted thread, dropped fields are unchanged if they hash the same
+        if old_fields.get(EVICTED) == evicted_digest(new_fields):
+            old_fields.update(
+                (key, new_fields[key]) for key in EVICTED_FIELDS if key in new_fields
+            )
         # Track last time that some meaningful data changed to tell clients to full check it
         if any(
             new_fields.get(key) != old_fields.get(key)
@@ -191,9 +503,66 @@ async def _update_thread_cache(id: int, name: str) -> None:
         ):
             new_fields[LAST_CHANGE] = int(now)
             logger.info(f"Data for {name} changed")
+        CACHE_UPDATES.inc(result="changed" if LAST_CHANGE in new_fields else "unchanged")
 
     new_fields[LAST_CACHED] = int(now)
     new_fields[CACHED_WITH] = meta.version
     if LAST_CHANGE not in old_fields and LAST_CHANGE not in new_fields:
         new_fields[LAST_CHANGE] = int(now)
-    await redis.hmset(name, new_fields)
+
+    # Indexes change in the same transaction as the thread itself
+    async with redis.pipeline(transaction=True) as pipeline:
+        pipeline.hset(name, mapping=codec.encode(new_fields))
+        if not isinstance(result, f95zone.IndexerError):
+            pipeline.hdel(name, EVICTED)
+        pipeline.zadd(INDEX_ACCESS, {id: int(now)}, nx=True)
+        pipeline.zadd(INDEX_IDS, {id: id})
+        pipeline.zadd(INDEX_EXPIRE, {id: new_fields[EXPIRE_TIME]})
+        pipeline.zadd(
+            INDEX_LAST_CHANGE,
+            {id: new_fields.get(LAST_CHANGE) or old_fields[LAST_CHANGE]},
+        )
+        if LAST_CHANGE in new_fields:
+            pipeline.publish(CHANGES_CHANNEL, f"{id}:{new_fields[LAST_CHANGE]}")
+        await pipeline.execute()
+
+
+async def summarize() -> None:
+    # Counting errors means reading every thread, only the watcher leader does it
+    now = time.time()
+    expire_counts = redis.pipeline()
+    expire_counts.zcount(INDEX_EXPIRE, "-inf", now)
+    lower = now
+    for _, seconds in SUMMARY_EXPIRE_BUCKETS:
+        expire_counts.zcount(INDEX_EXPIRE, f"({lower}", now + seconds)
+        lower = now + seconds
+    expire_counts.zcount(INDEX_EXPIRE, f"({lower}", "+inf")
+    expire_counts = await expire_counts.execute()
+    CACHE_EXPIRING.values.clear()
+    CACHE_EXPIRING.set(expire_counts[0], within="expired")
+    for (label, _), count in zip(SUMMARY_EXPIRE_BUCKETS, expire_counts[1:]):
+        CACHE_EXPIRING.set(count, within=label)
+    CACHE_EXPIRING.set(expire_counts[-1], within="later")
+
+    errors = {}
+    ids = []
+
+    async def count_errors():
+        index_errors = redis.pipeline()
+        for id in ids:
+            index_errors.hget(NAME_FORMAT.format(id=id), INDEX_ERROR)
+        for index_error in await index_errors.execute():
+            # Flag only, details would make a label per message
+            flag = (index_error or "").split(":")[0] or "none"
+            errors[flag] = errors.get(flag, 0) + 1
+
+    async for id, _ in redis.zscan_iter(INDEX_IDS, count=10000):
+        ids.append(id)
+        if len(ids) >= INDEX_BACKFILL_CHUNK_SIZE:
+            await count_errors()
+            ids = []
+    if ids:
+        await count_errors()
+    CACHE_THREADS.values.clear()
+    for flag, count in errors.items():
+        CACHE_THREADS.set(count, error=flag)
@@ -0,0 +1,159 @@
+import asyncio
+import base64
+import contextlib
+import datetime as dt
+import logging
+import os
+
+import zstandard
+
+from external import error
+from indexer import (
+    cache,
+    metrics,
+)
+
+# Redis responses are decoded as text, so compressed values are base85 encoded
+# and marked with a prefix that plain text and JSON fields never start with
+CODEC_PREFIX = "\x00zstd:"
+CODEC_FIELDS = (
+    "description",
+    "changelog",
+    "downloads",
+    "reviews",
+)
+CODEC_MIN_SIZE = 256
+CODEC_LEVEL = 10
+CODEC_DICTIONARY = "codec:dictionary"  # ID of the dictionary used for new values
+CODEC_DICTIONARIES = "codec:dictionaries"  # Every dictionary used, older values still need theirs
+CODEC_DICTIONARY_SIZE = 110 * 1024
+CODEC_TRAIN_SAMPLES = 5000
+CODEC_TRAIN_MIN_SAMPLES = 500
+CODEC_TRAIN_TIMEOUT = dt.timedelta(minutes=30).total_seconds()
+
+logger = logging.getLogger(__name__)
+enabled: bool = False
+dictionary_id: int = 0
+compressor = zstandard.ZstdCompressor(level=CODEC_LEVEL)
+decompressors: dict[int, zstandard.ZstdDecompressor] = {
+    0: zstandard.ZstdDecompressor(),
+}
+
+CODEC_RAW_BYTES = metrics.Counter(
+    "indexer_codec_raw_bytes",
+    "Bytes of large thread fields written, before compression",
+    labels=("field",),
+)
+CODEC_STORED_BYTES = metrics.Counter(
+    "indexer_codec_stored_bytes",
+    "Bytes of large thread fields written, as stored in redis",
+    labels=("field",),
+)
+
+
+@contextlib.asynccontextmanager
+async def lifespan():
+    global enabled
+    # Opt-in, but values compressed earlier stay readable either way
+    enabled = os.environ.get("CACHE_COMPRESS", "0") == "1"
+    train_task = None
+    if enabled:
+        if not await load_dictionary():
+            train_task = asyncio.create_task(train_dictionary())
+        logger.info(f"Compressing large thread fields with dictionary {dictionary_id}")
+
+    try:
+        yield
+    finally:
+        if train_task:
+            train_task.cancel()
+
+
+def _use_dictionary(dictionary: zstandard.ZstdCompressionDict) -> None:
+    global compressor, dictionary_id
+    dictionary_id = dictionary.dict_id()
+    compressor = zstandard.ZstdCompressor(level=CODEC_LEVEL, dict_data=dictionary)
+    decompressors[dictionary_id] = zstandard.ZstdDecompressor(dict_data=dictionary)
+
+
+async def load_dictionary() -> bool:
+    if not (id := await cache.redis.get(CODEC_DICTIONARY)):
+        return False
+    data = await cache.redis.hget(CODEC_DICTIONARIES, id)
+    _use_dictionary(zstandard.ZstdCompressionDict(base64.b85decode(data)))
+    return True
+
+
+async def train_dictionary():
+    # Shared by all workers, trained once per redis from threads already cached
+    try:
+        async with cache.shared_lock(f"lock:{CODEC_DICTIONARY}", CODEC_TRAIN_TIMEOUT):
+            if await load_dictionary():
+                return
+            samples = []
+            async for name in cache.redis.scan_iter("thread:*", 1000, "hash"):
+                values = await cache.redis.hmget(name, CODEC_FIELDS)
+                fields = {key: value for key, value in zip(CODEC_FIELDS, values) if value}
+                samples += (value.encode() for value in (await decode(fields)).values())
+                if len(samples) >= CODEC_TRAIN_SAMPLES:
+                    break
+            if len(samples) < CODEC_TRAIN_MIN_SAMPLES:
+                logger.info(f"Only {len(samples)} samples, compressing without dictionary for now")
+                return
+            dictionary = await asyncio.to_thread(
+                zstandard.train_dictionary, CODEC_DICTIONARY_SIZE, samples
+            )
+            async with cache.redis.pipeline(transaction=True) as pipeline:
+                pipeline.hset(
+                    CODEC_DICTIONARIES,
+                    dictionary.dict_id(),
+                    base64.b85encode(dictionary.as_bytes()).decode(),
+                )
+                pipeline.set(CODEC_DICTIONARY, dictionary.dict_id())
+                await pipeline.execute()
+            _use_dictionary(dictionary)
+            logger.info(f"Trained dictionary {dictionary_id} from {len(samples)} samples")
+    except Exception:
+        logger.error(f"Error training dictionary: {error.text()}\n{error.traceback()}")
+
+
+def compress(raw: bytes) -> str:
+    return CODEC_PREFIX + base64.b85encode(compressor.compress(raw)).decode()
+
+
+def encode(fields: dict[str, str]) -> dict[str, str]:
+    encoded = dict(fields)
+    for key in CODEC_FIELDS:
+        if not (value := fields.get(key)):
+            continue
+        raw = value.encode()
+        stored = len(raw)
+        if enabled and len(raw) >= CODEC_MIN_SIZE:
+            compressed = compress(raw)
+            # Short or random text can end up bigger with base85
+            if len(compressed) < len(raw):
+                encoded[key] = compressed
+                stored = len(compressed)
+        CODEC_RAW_BYTES.inc(len(raw), field=key)
+        CODEC_STORED_BYTES.inc(stored, field=key)
+    return encoded
+
+
+async def decode(fields: dict[str, str]) -> dict[str, str]:
+    for key in CODEC_FIELDS:
+        value = fields.get(key)
+        if not value or not value.startswith(CODEC_PREFIX):
+            continue
+        data = base64.b85decode(value[len(CODEC_PREFIX):])
+        decompressor = await _decompressor(zstandard.get_frame_parameters(data).dict_id)
+        fields[key] = decompressor.decompress(data).decode()
+    return fields
+
+
+async def _decompressor(id: int) -> zstandard.ZstdDecompressor:
+    # Dictionary trained by another worker after this one started
+    if id not in decompressors:
+        data = await cache.redis.hget(CODEC_DICTIONARIES, id)
+        dictionary = zstandard.ZstdCompressionDict(base64.b85decode(data))
+        decompressors[id] = zstandard.ZstdDecompressor(dict_data=dictionary)
+    return decompressors[id]
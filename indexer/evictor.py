@@ -0,0 +1,142 @@
+import asyncio
+import contextlib
+import datetime as dt
+import logging
+import os
+import time
+
+from external import error
+from indexer import (
+    cache,
+    codec,
+    metrics,
+    watcher,
+)
+
+EVICT_INTERVAL = dt.timedelta(minutes=30).total_seconds()
+EVICT_CHUNK_SIZE = 500
+EVICT_MAX_PER_RUN = 20000
+EVICT_ACCESS_BACKFILLED = "index:access:backfilled"
+
+logger = logging.getLogger(__name__)
+max_age: float = 0
+max_memory: int = 0
+
+EVICTED_THREADS = metrics.Counter(
+    "indexer_evicted_threads",
+    "Cold threads slimmed down to their last change",
+    labels=("reason",),
+)
+
+
+@contextlib.asynccontextmanager
+async def lifespan():
+    global max_age, max_memory
+    # Both off by default, threads are then only ever marked expired
+    max_age = dt.timedelta(days=int(os.environ.get("EVICT_MAX_AGE_DAYS", 0))).total_seconds()
+    max_memory = int(os.environ.get("EVICT_MAX_MEMORY_MB", 0)) * 1024 * 1024
+    evict_task = None
+    if max_age or max_memory:
+        evict_task = asyncio.create_task(watch_evictions())
+        logger.info(
+            "Evicting threads"
+            + (f" unused for {max_age / 86400:.0f} days" if max_age else "")
+            + (" or" if max_age and max_memory else "")
+            + (f" over {max_memory / 1024 / 1024:.0f} MiB" if max_memory else "")
+        )
+
+    try:
+        yield
+    finally:
+        if evict_task:
+            evict_task.cancel()
+
+
+async def watch_evictions():
+    await asyncio.sleep(60)
+
+    while True:
+        # Same worker that polls F95zone, no need for another election
+        if watcher.leader:
+            await evict()
+        await asyncio.sleep(EVICT_INTERVAL)
+
+
+async def evict():
+    try:
+        start = time.perf_counter()
+        await backfill_access()
+        evicted = 0
+
+        if max_age:
+            while evicted < EVICT_MAX_PER_RUN:
+                ids = await cache.redis.zrangebyscore(
+                    cache.INDEX_ACCESS,
+                    "-inf",
+                    time.time() - max_age,
+                    start=0,
+                    num=EVICT_CHUNK_SIZE,
+                )
+                if not ids:
+                    break
+                evicted += await evict_chunk([int(id) for id in ids], "age")
+
+        if max_memory:
+            while evicted < EVICT_MAX_PER_RUN:
+                memory = await cache.redis.info("memory")
+                if memory["used_memory"] <= max_memory:
+                    break
+                ids = await cache.redis.zrange(cache.INDEX_ACCESS, 0, EVICT_CHUNK_SIZE - 1)
+                if not ids:
+                    logger.warning("Over memory budget with nothing left to evict")
+                    break
+                evicted += await evict_chunk([int(id) for id in ids], "memory")
+
+        if evicted:
+            logger.info(f"Evicted {evicted} threads in {time.perf_counter() - start:.1f}s")
+
+    except Exception:
+        logger.error(f"Error evicting threads: {error.text()}\n{error.traceback()}")
+
+
+async def backfill_access():
+    # Threads cached before access was tracked, count them as used today
+    if await cache.redis.exists(EVICT_ACCESS_BACKFILLED):
+        return
+    now = int(time.time())
+    ids = []
+    async for id, _ in cache.redis.zscan_iter(cache.INDEX_IDS, count=10000):
+        ids.append(id)
+        if len(ids) >= cache.INDEX_BACKFILL_CHUNK_SIZE:
+            await cache.redis.zadd(cache.INDEX_ACCESS, dict.fromkeys(ids, now), nx=True)
+            ids = []
+    if ids:
+        await cache.redis.zadd(cache.INDEX_ACCESS, dict.fromkeys(ids, now), nx=True)
+    await cache.redis.set(EVICT_ACCESS_BACKFILLED, now)
+
+
+async def evict_chunk(ids: list[int], reason: str) -> int:
+    names = [cache.NAME_FORMAT.format(id=id) for id in ids]
+    cached_data = cache.redis.pipeline()
+    for name in names:
+        cached_data.hmget(name, (cache.EVICTED, *cache.EVICTED_FIELDS))
+    cached_data = await cached_data.execute()
+
+    slim = cache.redis.pipeline(transaction=True)
+    evicted = 0
+    for id, name, (already_evicted, *values) in zip(ids, names, cached_data):
+        # Back in the access index once it gets requested or refreshed again
+        slim.zrem(cache.INDEX_ACCESS, id)
+        if already_evicted or not any(values):
+            continue
+        fields = await codec.decode(dict(zip(cache.EVICTED_FIELDS, values)))
+        # Next full request has to fetch it again, refresh-ahead skips it like any invalidated one
+        slim.hdel(name, *cache.EVICTED_FIELDS)
+        cache.invalidate(slim, id)
+        slim.hset(name, cache.EVICTED, cache.evicted_digest(fields))
+        slim.delete(cache.REVIEWS_NAME_FORMAT.format(id=id))
+        evicted += 1
+    await slim.execute()
+
+    EVICTED_THREADS.inc(evicted, reason=reason)
+    return evicted
@@ -8,14 +8,21 @@ import re
 import sys
 
 import aiohttp
-import aiolimiter
 
 from common import (
     meta,
     parser,
 )
+from indexer import (
+    metrics,
+    ratelimit,
+)
 
-RATELIMIT = aiolimiter.AsyncLimiter(max_rate=1, time_period=0.5)
+# Shared by all workers and hosts using the same redis
+RATELIMIT = ratelimit.SharedLimiter(
+    "f95zone",
+    ratelimit.AdaptiveRate(rate=2, min_rate=0.1, max_rate=5),
+)
 TIMEOUT = aiohttp.ClientTimeout(total=30, connect=30, sock_read=30, sock_connect=30)
 LOGIN_ERROR_MESSAGES = (
     b'<a href="/login/" data-xf-click="overlay">Log in or register now.</a>',
@@ -52,6 +59,17 @@ THREAD_MISSING_MESSAGES = (
     "You do not have permission to view this page or perform this action.",
 )
 
+F95ZONE_ERRORS = metrics.Counter(
+    "indexer_f95zone_errors",
+    "Errors detected in F95zone responses, by error flag",
+    labels=("error",),
+)
+F95ZONE_RATELIMITED = metrics.Counter(
+    "indexer_f95zone_ratelimited",
+    "HTTP 429 responses from F95zone that were retried, by request kind",
+    labels=("kind",),
+)
+
 logger = logging.getLogger(__name__)
 session: aiohttp.ClientSession = None
 cookies: dict = None
@@ -130,6 +148,14 @@ async def lifespan():
 
 
 def check_error(
+    res: bytes | dict | Exception, logger: logging.Logger = logger
+) -> IndexerError | None:
+    if index_error := _check_error(res, logger):
+        F95ZONE_ERRORS.inc(error=index_error.error_flag)
+    return index_error
+
+
+def _check_error(
     res: bytes | dict | Exception, logger: logging.Logger
 ) -> IndexerError | None:
     if isinstance(res, bytes):
@@ -0,0 +1,308 @@
+import asyncio
+import bisect
+import contextlib
+import datetime as dt
+import json
+import logging
+import os
+import socket
+import time
+
+import fastapi
+import redis.asyncio as aredis
+
+from external import error
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+# Workers behind one port can't be scraped one by one, so each adds its counts to
+# redis and /metrics shows the total from any of them. Counters and histograms are
+# summed in one hash, gauges are kept per worker and dropped when it stops flushing
+METRICS_FLUSH_INTERVAL = dt.timedelta(seconds=10).total_seconds()
+METRICS_WORKERS = "metrics:workers"
+METRICS_NAME_FORMAT = "metrics:{name}"
+METRICS_WORKER_NAME_FORMAT = "metrics:{name}:{worker}"
+
+logger = logging.getLogger(__name__)
+# Own client, everything else imports this module before cache is ready
+redis: aredis.Redis = None
+registry: list["Metric"] = []
+worker = f"{socket.gethostname()}:{os.getpid()}"
+# /metrics and the flush loop both flush, deltas must not be sent twice
+flush_lock = asyncio.Lock()
+
+router = fastapi.APIRouter()
+
+
+class Metric:
+    type = ""
+
+    def __init__(self, name: str, documentation: str, labels: tuple[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.values: dict[tuple[str], float] = {}
+        self.flushed: dict[str, float] = {}
+        registry.append(self)
+
+    def fields(self) -> dict[str, float]:
+        return {json.dumps(key): value for key, value in self.values.items()}
+
+    def from_fields(self, fields: dict[str, float]) -> dict[tuple[str], float]:
+        return {tuple(json.loads(field)): value for field, value in fields.items()}
+
+    def _key(self, labels: dict[str, str]) -> tuple[str]:
+        return tuple(str(labels[label]) for label in self.labels)
+
+    def _labels(self, key: tuple[str], **extra: str) -> str:
+        pairs = [*zip(self.labels, key), *extra.items()]
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+    def render(self, values: dict[tuple[str], float]) -> list[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type}",
+        ]
+        for key, value in sorted(values.items()):
+            lines.append(f"{self.name}{self._labels(key)} {value:g}")
+        return lines
+
+
+class Counter(Metric):
+    type = "counter"
+    per_worker = False
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    type = "gauge"
+    per_worker = True
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: tuple[str] = (),
+        aggregate: str = "sum",
+    ):
+        super().__init__(name, documentation, labels)
+        # How workers are combined, "sum" for their share of a total, "max" for a shared value
+        self.aggregate = aggregate
+
+    def set(self, value: float, **labels: str) -> None:
+        self.values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels: str) -> None:
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    type = "histogram"
+    per_worker = False
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: tuple[str] = (),
+        buckets: tuple[float] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, documentation, labels)
+        self.buckets = buckets
+        # Per label set: [bucket counts..., +Inf count, sum]
+        self.values: dict[tuple[str], list[float]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        if key not in self.values:
+            self.values[key] = [0] * (len(self.buckets) + 2)
+        observations = self.values[key]
+        observations[bisect.bisect_left(self.buckets, value)] += 1
+        observations[-1] += value
+
+    def fields(self) -> dict[str, float]:
+        return {
+            json.dumps([*key, i]): observed
+            for key, observations in self.values.items()
+            for i, observed in enumerate(observations)
+        }
+
+    def from_fields(self, fields: dict[str, float]) -> dict[tuple[str], list[float]]:
+        values = {}
+        for field, observed in fields.items():
+            *key, i = json.loads(field)
+            observations = values.setdefault(tuple(key), [0] * (len(self.buckets) + 2))
+            observations[i] = observed
+        return values
+
+    def render(self, values: dict[tuple[str], list[float]]) -> list[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type}",
+        ]
+        for key, observations in sorted(values.items()):
+            # Buckets are stored separately, exposition wants them cumulative
+            count = 0
+            for bucket, observed in zip((*self.buckets, "+Inf"), observations):
+                count += observed
+                lines.append(f"{self.name}_bucket{self._labels(key, le=bucket)} {count:g}")
+            lines.append(f"{self.name}_sum{self._labels(key)} {observations[-1]:g}")
+            lines.append(f"{self.name}_count{self._labels(key)} {count:g}")
+        return lines
+
+    @contextlib.contextmanager
+    def time(self, **labels: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+
+REQUEST_SECONDS = Histogram(
+    "indexer_request_seconds",
+    "Time until the response starts, by route and status",
+    labels=("route", "status"),
+)
+
+
+class Middleware:
+    # Plain ASGI, so streaming responses pass through untouched
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        start = time.perf_counter()
+
+        async def observe_send(message):
+            if message["type"] == "http.response.start":
+                # Set by the router once matched, before the response starts
+                route = getattr(scope.get("route"), "path", "other")
+                REQUEST_SECONDS.observe(
+                    time.perf_counter() - start,
+                    route=route,
+                    status=message["status"],
+                )
+            await send(message)
+
+        await self.app(scope, receive, observe_send)
+
+
+@contextlib.asynccontextmanager
+async def lifespan():
+    global redis
+    redis = aredis.Redis.from_url(
+        os.environ.get("REDIS_URL", "redis://localhost:6379"),
+        decode_responses=True,
+    )
+    flush_task = asyncio.create_task(watch_flush())
+
+    try:
+        yield
+    finally:
+        flush_task.cancel()
+        await asyncio.gather(flush_task, return_exceptions=True)
+        # Last counts in, and this worker's gauges out of the totals
+        try:
+            await flush()
+            async with redis.pipeline(transaction=True) as pipeline:
+                pipeline.zrem(METRICS_WORKERS, worker)
+                for metric in registry:
+                    if metric.per_worker:
+                        pipeline.delete(METRICS_WORKER_NAME_FORMAT.format(name=metric.name, worker=worker))
+                await pipeline.execute()
+        except Exception:
+            logger.error(f"Error flushing metrics: {error.text()}\n{error.traceback()}")
+        await redis.aclose()
+        redis = None
+
+
+async def watch_flush():
+    while True:
+        await asyncio.sleep(METRICS_FLUSH_INTERVAL)
+        try:
+            await flush()
+        except Exception:
+            logger.error(f"Error flushing metrics: {error.text()}\n{error.traceback()}")
+
+
+async def flush():
+    async with flush_lock:
+        flushed = {}
+        async with redis.pipeline(transaction=True) as pipeline:
+            for metric in registry:
+                fields = metric.fields()
+                if metric.per_worker:
+                    # Replaced whole, label sets that were cleared go away too
+                    name = METRICS_WORKER_NAME_FORMAT.format(name=metric.name, worker=worker)
+                    pipeline.delete(name)
+                    if fields:
+                        pipeline.hset(name, mapping=fields)
+                        pipeline.expire(name, int(METRICS_FLUSH_INTERVAL * 3))
+                else:
+                    # Only what was added since the last flush, totals live in redis
+                    name = METRICS_NAME_FORMAT.format(name=metric.name)
+                    for field, value in fields.items():
+                        if delta := value - metric.flushed.get(field, 0):
+                            pipeline.hincrbyfloat(name, field, delta)
+                flushed[metric] = fields
+            pipeline.zadd(METRICS_WORKERS, {worker: time.time()})
+            await pipeline.execute()
+        for metric, fields in flushed.items():
+            metric.flushed = fields
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+async def render() -> str:
+    await flush()
+    now = time.time()
+    await redis.zremrangebyscore(METRICS_WORKERS, "-inf", now - METRICS_FLUSH_INTERVAL * 3)
+    workers = await redis.zrange(METRICS_WORKERS, 0, -1)
+
+    totals = redis.pipeline()
+    for metric in registry:
+        if metric.per_worker:
+            for other in workers:
+                totals.hgetall(METRICS_WORKER_NAME_FORMAT.format(name=metric.name, worker=other))
+        else:
+            totals.hgetall(METRICS_NAME_FORMAT.format(name=metric.name))
+    totals = iter(await totals.execute())
+
+    lines = []
+    for metric in registry:
+        if metric.per_worker:
+            fields = {}
+            for _ in workers:
+                for field, value in next(totals).items():
+                    if metric.aggregate == "max":
+                        fields[field] = max(fields.get(field, float(value)), float(value))
+                    else:
+                        fields[field] = fields.get(field, 0) + float(value)
+        else:
+            fields = {field: float(value) for field, value in next(totals).items()}
+        lines += metric.render(metric.from_fields(fields))
+    return "\n".join(lines) + "\n"
+
+
+@router.get("/metrics")
+async def metrics_request():
+    # Totals of all workers, whichever one answers
+    return fastapi.responses.Response(
+        await render(),
+        status_code=200,
+        media_type=CONTENT_TYPE,
+    )
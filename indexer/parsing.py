@@ -0,0 +1,83 @@
+import asyncio
+import concurrent.futures
+import contextlib
+import logging
+import multiprocessing
+import os
+import typing
+
+from common import parser
+from indexer import metrics
+
+logger = logging.getLogger(__name__)
+executor: concurrent.futures.Executor = None
+slots: asyncio.Semaphore = None
+fast: bool = False
+
+PARSE_SECONDS = metrics.Histogram(
+    "indexer_parse_seconds",
+    "Time spent parsing F95zone pages",
+    labels=("kind",),
+)
+PARSE_QUEUE_DEPTH = metrics.Gauge(
+    "indexer_parse_queue_depth",
+    "Pages waiting for a free parse slot",
+)
+PARSE_RUNNING = metrics.Gauge(
+    "indexer_parse_running",
+    "Pages currently being parsed",
+)
+
+
+@contextlib.asynccontextmanager
+async def lifespan():
+    global executor, slots, fast
+    workers = int(os.environ.get("PARSE_WORKERS", 0)) or os.cpu_count() or 1
+    queue_size = int(os.environ.get("PARSE_QUEUE_SIZE", 0)) or workers * 2
+    if os.environ.get("PARSE_PROCESSES", "1") == "1":
+        # Parsing is pure CPU, keep it away from the GIL of the event loop
+        executor = concurrent.futures.ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    else:
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+    # Bounds pages handed to the pool, callers wait for a slot instead of piling up
+    slots = asyncio.Semaphore(queue_size)
+    # Opt-in lxml thread parser, much cheaper but so far only checked against synthetic pages
+    fast = os.environ.get("PARSE_FAST", "0") == "1"
+    logger.info(
+        f"Parsing with {workers} {type(executor).__name__} workers, {queue_size} slots"
+        + (", experimental fast thread parser" if fast else "")
+    )
+
+    try:
+        yield
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+        executor = None
+        slots = None
+
+
+async def run(func: typing.Callable[[bytes], typing.Any], res: bytes) -> typing.Any:
+    loop = asyncio.get_running_loop()
+    PARSE_QUEUE_DEPTH.inc()
+    try:
+        await slots.acquire()
+    finally:
+        PARSE_QUEUE_DEPTH.dec()
+    PARSE_RUNNING.inc()
+    try:
+        with PARSE_SECONDS.time(kind=func.__name__):
+            return await loop.run_in_executor(executor, func, res)
+    finally:
+        PARSE_RUNNING.dec()
+        slots.release()
+
+
+async def thread(res: bytes) -> parser.ParsedThread | parser.ParserError:
+    return await run(parser.thread_fast if fast else parser.thread, res)
+
+
+async def reviews(res: bytes) -> parser.ParsedReviews | parser.ParserError:
+    return await run(parser.reviews, res)
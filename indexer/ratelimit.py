@@ -0,0 +1,140 @@
+import asyncio
+import logging
+
+from common.ratelimit import AdaptiveRate
+from external import error
+from indexer import (
+    cache,
+    metrics,
+)
+
+# Adjust the shared rate, then reserve the next free slot and return how many ms to
+# wait for it, using redis time so all workers and hosts agree on the schedule.
+# AIMD like common.ratelimit.AdaptiveRate, but one rate for everyone, so a 429 seen
+# by any worker slows all of them down. Reserve 0 only applies the adjustment
+RESERVE_SCRIPT = """
+local time = redis.call("TIME")
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+local rate = tonumber(redis.call("HGET", KEYS[2], "rate") or ARGV[1])
+local held_until = tonumber(redis.call("HGET", KEYS[2], "held_until") or 0)
+local succeeded = tonumber(ARGV[2])
+local throttled = tonumber(ARGV[3])
+local min_rate, max_rate = tonumber(ARGV[4]), tonumber(ARGV[5])
+local increase, decrease, hold = tonumber(ARGV[6]), tonumber(ARGV[7]), tonumber(ARGV[8])
+if now >= held_until then
+    if throttled > 0 then
+        rate = rate * decrease
+        held_until = now + hold
+    else
+        rate = rate + increase * succeeded
+    end
+end
+rate = math.max(min_rate, math.min(rate, max_rate))
+redis.call("HSET", KEYS[2], "rate", tostring(rate), "held_until", held_until)
+redis.call("EXPIRE", KEYS[2], 86400)
+if ARGV[9] == "0" then
+    return {0, tostring(rate)}
+end
+local slot = tonumber(redis.call("GET", KEYS[1]) or 0)
+if slot < now then
+    slot = now
+end
+local interval = math.ceil(1000 / rate)
+redis.call("SET", KEYS[1], slot + interval, "PX", slot - now + interval)
+return {slot - now, tostring(rate)}
+"""
+
+logger = logging.getLogger(__name__)
+
+RATELIMIT_WAIT_SECONDS = metrics.Histogram(
+    "indexer_ratelimit_wait_seconds",
+    "Time spent waiting for a shared ratelimit slot",
+    labels=("name",),
+)
+RATELIMIT_RATE = metrics.Gauge(
+    "indexer_ratelimit_rate",
+    "Current requests per second allowed by the adaptive ratelimit",
+    labels=("name",),
+    aggregate="max",
+)
+RATELIMIT_WAITING = metrics.Gauge(
+    "indexer_ratelimit_waiting",
+    "Requests waiting for a ratelimit slot in this worker",
+    labels=("name",),
+)
+
+
+class SharedLimiter:
+    """Like common.ratelimit.AdaptiveLimiter, but slots and rate are shared through redis"""
+
+    def __init__(self, name: str, rate: AdaptiveRate):
+        self.name = f"ratelimit:{name}"
+        # Starting rate and AIMD parameters, the current rate lives in redis
+        self.rate = rate
+        self._succeeded = 0
+        self._throttled = 0
+        self._script = None
+        self._tasks: set[asyncio.Task] = set()
+        RATELIMIT_RATE.set(self.rate.rate, name=self.name)
+
+    def succeeded(self) -> None:
+        # Added to the shared rate with the next slot reservation
+        self._succeeded += 1
+
+    def throttled(self) -> None:
+        # Cut the shared rate right away, other workers shouldn't wait for this one's next request
+        self._throttled += 1
+        task = asyncio.create_task(self._adjust())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _adjust(self) -> None:
+        try:
+            await self._reserve(reserve=False)
+        except Exception:
+            logger.error(f"Error adjusting {self.name}: {error.text()}\n{error.traceback()}")
+
+    async def _reserve(self, reserve: bool = True) -> float:
+        if self._script is None or self._script.registered_client is not cache.redis:
+            self._script = cache.redis.register_script(RESERVE_SCRIPT)
+        succeeded, throttled = self._succeeded, self._throttled
+        self._succeeded = self._throttled = 0
+        try:
+            wait, rate = await self._script(
+                keys=[self.name, f"{self.name}:rate"],
+                args=[
+                    self.rate.rate,
+                    succeeded,
+                    throttled,
+                    self.rate.min_rate,
+                    self.rate.max_rate,
+                    self.rate.increase,
+                    self.rate.decrease,
+                    int(self.rate.hold * 1000),
+                    int(reserve),
+                ],
+            )
+        except Exception:
+            # Not applied, try again with the next one
+            self._succeeded += succeeded
+            self._throttled += throttled
+            raise
+        self.rate.rate = float(rate)
+        RATELIMIT_RATE.set(self.rate.rate, name=self.name)
+        return wait
+
+    async def acquire(self) -> None:
+        wait = await self._reserve()
+        RATELIMIT_WAIT_SECONDS.observe(wait / 1000, name=self.name)
+        if wait > 0:
+            RATELIMIT_WAITING.inc(name=self.name)
+            try:
+                await asyncio.sleep(wait / 1000)
+            finally:
+                RATELIMIT_WAITING.dec(name=self.name)
+
+    async def __aenter__(self) -> None:
+        await self.acquire()
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        pass
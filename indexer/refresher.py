@@ -0,0 +1,174 @@
+import asyncio
+import contextlib
+import contextvars
+import datetime as dt
+import itertools
+import logging
+import os
+import time
+
+from external import error
+from indexer import (
+    cache,
+    metrics,
+    scraper,
+    watcher,
+)
+
+PRIORITY_MISSING = 0  # Client is waiting for it
+PRIORITY_STALE = 1  # Client was served expired data
+PRIORITY_UPDATED = 2  # Watcher saw it change, clients will ask soon
+PRIORITY_BACKGROUND = 3  # Nobody asked for it yet
+
+# Refresh threads in the last few percent of their TTL (~5% of 7 days), before clients find them expired
+REFRESH_AHEAD_INTERVAL = dt.timedelta(minutes=1).total_seconds()
+REFRESH_AHEAD_WINDOW = dt.timedelta(hours=8).total_seconds()
+REFRESH_AHEAD_CANDIDATES = 5000
+
+logger = logging.getLogger(__name__)
+queue: asyncio.PriorityQueue = None
+pending: dict[int, tuple[int, int, asyncio.Future]] = {}
+sequence = itertools.count()
+# Fair queuing, within a priority each client gets a turn in order instead of first come first served
+client: contextvars.ContextVar[str | None] = contextvars.ContextVar("client", default=None)
+finish_tags: dict[str | None, int] = {}
+virtual_time: int = 0
+ahead_per_minute: int = 0
+
+REFRESHED_AHEAD = metrics.Counter(
+    "indexer_refreshed_ahead",
+    "Threads queued for refresh before they expired",
+)
+
+
+@contextlib.asynccontextmanager
+async def lifespan():
+    global queue, ahead_per_minute
+    queue = asyncio.PriorityQueue()
+    workers = [
+        asyncio.create_task(worker())
+        for _ in range(int(os.environ.get("REFRESH_WORKERS", 4)))
+    ]
+    ahead_per_minute = int(os.environ.get("REFRESH_AHEAD_PER_MINUTE", 10))
+    ahead_task = None
+    if ahead_per_minute:
+        ahead_task = asyncio.create_task(watch_expiring())
+
+    try:
+        yield
+    finally:
+        tasks = [*workers, *([ahead_task] if ahead_task else [])]
+        for task in tasks:
+            task.cancel()
+        # Let scrapes in flight unwind before redis and the session are closed
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for _, _, future in pending.values():
+            future.cancel()
+        pending.clear()
+        finish_tags.clear()
+        queue = None
+
+
+def enqueue(id: int, priority: int) -> asyncio.Future:
+    # Deduplicate, but let a more urgent request jump ahead
+    if queued := pending.get(id):
+        queued_priority, _, future = queued
+        if priority >= queued_priority:
+            return future
+    else:
+        future = asyncio.get_running_loop().create_future()
+    seq = next(sequence)
+    pending[id] = (priority, seq, future)
+    # Each client's threads are spaced one turn apart, after whatever is being served now
+    key = client.get()
+    tag = max(virtual_time, finish_tags.get(key, 0)) + 1
+    finish_tags[key] = tag
+    queue.put_nowait((priority, tag, seq, id))
+    logger.debug(f"Queued thread:{id} with priority {priority} ({len(pending)} pending)")
+    return future
+
+
+async def refresh(id: int, priority: int = PRIORITY_MISSING) -> None:
+    # Shield so a disconnecting client doesn't cancel it for others waiting
+    await asyncio.shield(enqueue(id, priority))
+
+
+async def worker():
+    global virtual_time
+    while True:
+        priority, tag, seq, id = await queue.get()
+        virtual_time = max(virtual_time, tag)
+        if queue.empty():
+            # Nobody is behind anymore, forget clients that went quiet
+            finish_tags.clear()
+
+        # Skip leftovers from entries that were bumped to a higher priority
+        queued = pending.get(id)
+        if not queued or queued[1] != seq:
+            continue
+        _, _, future = queued
+        # Version lookups for what is queued next, in one request instead of one per scrape
+        if len(pending) > 1:
+            scraper.prefetch_versions([queued_id for queued_id in pending if queued_id != id])
+
+        try:
+            # Nobody asked for background ones, they are refreshed before expiring
+            ahead = REFRESH_AHEAD_WINDOW if priority == PRIORITY_BACKGROUND else 0
+            await cache.refresh_thread(id, ahead)
+        except Exception:
+            logger.error(f"Error refreshing thread:{id}: {error.text()}\n{error.traceback()}")
+        finally:
+            pending.pop(id, None)
+            if not future.done():
+                future.set_result(None)
+
+
+async def watch_expiring():
+    await asyncio.sleep(60)
+
+    while True:
+        # Same worker that polls F95zone, no need for another election
+        if watcher.leader:
+            await refresh_ahead()
+        await asyncio.sleep(REFRESH_AHEAD_INTERVAL)
+
+
+async def refresh_ahead():
+    try:
+        # Whatever is still queued from last time counts against the budget
+        budget = ahead_per_minute - sum(
+            priority == PRIORITY_BACKGROUND for priority, _, _ in pending.values()
+        )
+        if budget <= 0:
+            return
+
+        # Soonest to expire first, invalidated ones (0) are left to clients and watcher,
+        # evicted threads are not in the access index, so keep paging past those
+        candidates = []
+        start = 0
+        while len(candidates) < budget:
+            page = await cache.redis.zrangebyscore(
+                cache.INDEX_EXPIRE,
+                "(0",
+                time.time() + REFRESH_AHEAD_WINDOW,
+                start=start,
+                num=REFRESH_AHEAD_CANDIDATES,
+            )
+            start += len(page)
+            ids = [int(id) for id in page if int(id) not in pending]
+            if ids:
+                accessed = await cache.redis.zmscore(cache.INDEX_ACCESS, ids)
+                candidates += [
+                    (access, id) for id, access in zip(ids, accessed) if access is not None
+                ]
+            if len(page) < REFRESH_AHEAD_CANDIDATES:
+                break
+
+        # Most recently requested first
+        candidates.sort(reverse=True)
+        for _, id in candidates[:budget]:
+            enqueue(id, PRIORITY_BACKGROUND)
+        REFRESHED_AHEAD.inc(min(len(candidates), budget))
+
+    except Exception:
+        logger.error(f"Error refreshing ahead: {error.text()}\n{error.traceback()}")
@@ -0,0 +1,100 @@
+import gzip
+import json
+
+import fastapi
+import zstandard
+
+COMPRESS_MIN_SIZE = 1024
+ZSTD_LEVEL = 3
+GZIP_LEVEL = 6
+ENCODINGS = (  # In order of preference
+    "zstd",
+    "gzip",
+)
+FORMATS = (
+    FORMAT_JSON := "json",  # Nested data as JSON strings, like it is stored
+    FORMAT_STRUCTURED := "structured",  # Nested data as native arrays/objects
+)
+
+zstd_compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL)
+
+
+def negotiate_encoding(accept_encoding: str | None) -> str | None:
+    accepted = {}
+    for item in (accept_encoding or "").split(","):
+        coding, *params = item.split(";")
+        quality = 1.0
+        for param in params:
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        accepted[coding.strip().lower()] = quality
+    for encoding in ENCODINGS:
+        if accepted.get(encoding, 0) > 0:
+            return encoding
+    return None
+
+
+def dumps(content: dict | list | str, raw_fields: tuple[str] = ()) -> bytes:
+    if isinstance(content, dict) and raw_fields:
+        # Fields that already hold JSON are spliced in as-is, no need to parse them
+        return (
+            "{"
+            + ",".join(
+                json.dumps(key, ensure_ascii=False)
+                + ":"
+                + (
+                    value
+                    if key in raw_fields and value
+                    else json.dumps(value, ensure_ascii=False)
+                )
+                for key, value in content.items()
+            )
+            + "}"
+        ).encode()
+    return json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+def json_response(
+    content: dict | list | str,
+    status_code: int,
+    encoding: str | None,
+    headers: dict[str, str] = None,
+    raw_fields: tuple[str] = (),
+) -> fastapi.Response:
+    body = dumps(content, raw_fields)
+    headers = dict(headers or {})
+    headers["Vary"] = "Accept-Encoding"
+
+    if encoding and len(body) >= COMPRESS_MIN_SIZE:
+        if encoding == "zstd":
+            body = zstd_compressor.compress(body)
+        elif encoding == "gzip":
+            body = gzip.compress(body, compresslevel=GZIP_LEVEL)
+        headers["Content-Encoding"] = encoding
+        # Different bytes for the same data, so the strong validator must differ too
+        if etag := headers.get("ETag"):
+            headers["ETag"] = f'{etag[:-1]}-{encoding}"'
+
+    return fastapi.responses.Response(
+        body,
+        status_code=status_code,
+        headers=headers,
+        media_type="application/json",
+    )
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    if if_none_match.strip() == "*":
+        return True
+    for tag in if_none_match.split(","):
+        tag = tag.strip().removeprefix("W/")
+        # Same data regardless of content encoding
+        for encoding in ENCODINGS:
+            tag = tag.replace(f'-{encoding}"', '"')
+        if tag == etag:
+            return True
+    return False
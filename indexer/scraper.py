@@ -1,13 +1,31 @@
 import asyncio
 import dataclasses
+import datetime as dt
 import json
 import logging
 import time
 
 from common import parser
-from indexer import f95zone
+from indexer import (
+    cache,
+    codec,
+    f95zone,
+    parsing,
+)
+
+VERSION_BATCH_DELAY = 0.005
+VERSION_BATCH_SIZE = 1000  # Max IDs the version API accepts at once
+# Scrapes are spaced out by the ratelimit, so few ever overlap in the batch window above,
+# versions for queued threads are checked up front instead, as many as get scraped in the TTL
+VERSION_PREFETCH_SIZE = 100
+VERSION_PREFETCH_TTL = dt.timedelta(minutes=10).total_seconds()
 
 logger = logging.getLogger(__name__)
+version_waiters: dict[int, list[asyncio.Future]] = {}
+version_batch: asyncio.TimerHandle = None
+version_tasks: set[asyncio.Task] = set()
+prefetched_versions: dict[int, tuple[str, float]] = {}
+prefetching: set[int] = set()
 
 
 async def thread(id: int) -> dict[str, str] | f95zone.IndexerError | None:
@@ -21,8 +39,10 @@ async def thread(id: int) -> dict[str, str] | f95zone.IndexerError | None:
                     cookies=f95zone.cookies,
                 ) as req:
                     if req.status == 429 and retries > 1:
-                        logger.warning("Hit a ratelimit, sleeping 2 seconds")
-                        await asyncio.sleep(2)
+                        # Slows down the shared ratelimit, next slot is further away
+                        logger.warning("Hit a ratelimit, slowing down")
+                        f95zone.F95ZONE_RATELIMITED.inc(kind="thread")
+                        f95zone.RATELIMIT.throttled()
                         retries -= 1
                         continue
                     res = await req.read()
@@ -33,10 +53,12 @@ async def thread(id: int) -> dict[str, str] | f95zone.IndexerError | None:
                 raise
 
     if index_error := f95zone.check_error(res, logger):
+        if index_error is f95zone.ERROR_F95ZONE_RATELIMIT:
+            f95zone.RATELIMIT.throttled()
         return index_error
+    f95zone.RATELIMIT.succeeded()
 
-    loop = asyncio.get_event_loop()
-    ret = await loop.run_in_executor(None, parser.thread, res)
+    ret = await parsing.thread(res)
     if isinstance(ret, parser.ParserError):
         logger.error(f"Thread {id} parsing failed: {ret.message}\n{ret.dump}")
         return f95zone.ERROR_PARSING_FAILED
@@ -45,101 +67,92 @@ async def thread(id: int) -> dict[str, str] | f95zone.IndexerError | None:
     # games/media/mods forums so it wont get cached for no reason
 
     # Check if thread is tracked by latest updates using version API, then keep this version value
-    version = ""
-    try:
-        async with f95zone.session.get(
-            f95zone.BULK_VERSION_CHECK_URL.format(threads=id),
-        ) as req:
-            res = await req.read()
-    except Exception as exc:
-        if index_error := f95zone.check_error(exc, logger):
-            return index_error
-        raise
-    if index_error := f95zone.check_error(res, logger):
-        return index_error
-    try:
-        versions = json.loads(res)
-    except Exception:
-        logger.error(f"Thread {id} version returned invalid JSON: {res}")
-        return f95zone.ERROR_UNKNOWN_RESPONSE
-    if versions.get("msg") in ("Missing threads data", "Thread not found"):
-        versions["status"] = "ok"
-        versions["msg"] = {}
-    if index_error := f95zone.check_error(versions, logger):
-        return index_error
-    if str(id) in versions["msg"]:
-        version = str(versions["msg"][str(id)])
-        if version == "Unknown":
-            version = ""
+    version = prefetched_version(id)
+    if version is None:
+        # A prefetch still running would be older than this check, don't let it land
+        prefetching.discard(id)
+        version = await thread_version(id)
+    if isinstance(version, f95zone.IndexerError):
+        return version
 
-    # If tracked by latest updates, try to search the thread there to get more precise details
+    # If tracked by latest updates, try to find the thread there to get more precise details
+    meta_digest = None
     if version:
-        query = f95zone.latest_updates_search_sanitize_query(ret.name)
-        for category in f95zone.LATEST_UPDATES_CATEGORIES:
-            try:
-                async with f95zone.session.get(
-                    f95zone.LATEST_UPDATES_SEARCH_URL.format(
-                        cmd="list",
-                        cat=category,
-                        page=1,
-                        search="search",
-                        query=query,
-                        sort="likes",
-                        rows=90,
-                        ts=int(time.time()),
-                    ),
-                    cookies=f95zone.cookies,
-                ) as req:
-                    res = await req.read()
-            except Exception as exc:
-                if index_error := f95zone.check_error(exc, logger):
-                    return index_error
-                raise
-            if index_error := f95zone.check_error(res, logger):
-                return index_error
-            try:
-                updates = json.loads(res)
-            except Exception:
-                logger.error(f"Thread {id} search returned invalid JSON: {res}")
-                return f95zone.ERROR_UNKNOWN_RESPONSE
-            if index_error := f95zone.check_error(updates, logger):
-                return index_error
+        update = await latest_update(id, ret.name)
+        if isinstance(update, f95zone.IndexerError):
+            return update
+        if update:
+            ret.name = update["title"] or ret.name
+            ret.developer = update["creator"] or ret.developer
+            ret.score = round(update["rating"], 1)
+            ret.image_url = parser.attachment(update["cover"]) or ret.image_url
+            ret.previews_urls = [
+                parser.attachment(preview_url)
+                for preview_url in update["screens"]
+            ] or ret.previews_urls
+            last_promoted = parser.datestamp(update["ts"])
+            if (
+                ret.last_updated > time.time()  # Only if thread has a typo
+                or last_promoted > ret.last_updated  # Or it's outdated
+            ):
+                ret.last_updated = last_promoted
+            # Watcher compares against this, no need to refresh for the record used here
+            if all(key in update for key in cache.LATEST_FIELDS):
+                meta_digest = cache.meta_digest(update)
+        else:
+            logger.warning(f"Thread {id} not found in latest updates search")
 
-            for update in updates["msg"]["data"]:
-                if update["thread_id"] == id:
-                    ret.name = update["title"] or ret.name
-                    ret.developer = update["creator"] or ret.developer
-                    ret.score = round(update["rating"], 1)
-                    ret.image_url = parser.attachment(update["cover"]) or ret.image_url
-                    ret.previews_urls = [
-                        parser.attachment(preview_url)
-                        for preview_url in update["screens"]
-                    ] or ret.previews_urls
-                    last_promoted = parser.datestamp(update["ts"])
-                    if (
-                        ret.last_updated > time.time()  # Only if thread has a typo
-                        or last_promoted > ret.last_updated  # Or it's outdated
-                    ):
-                        ret.last_updated = last_promoted
-                    break
-            else:  # Didn't break
-                continue
-            break
+    reviews = await thread_reviews(id, ret.votes)
+    if isinstance(reviews, f95zone.IndexerError):
+        return reviews
 
-        else:  # Didn't break
-            logger.warning(f"Thread {id} not found in latest updates search")
+    # Prepare for redis, only strings allowed
+    parsed = dataclasses.asdict(ret)
+    if version:
+        parsed["version"] = version
+        del parsed["thread_version"]
+    else:
+        parsed["version"] = parsed["thread_version"]
+        # Leave thread_version set so cache knows to use a lower TTL,
+        # but only if the thread had a valid version detected
+        if not parsed["thread_version"]:
+            del parsed["thread_version"]
+    parsed["type"] = str(int(parsed["type"]))
+    parsed["status"] = str(int(parsed["status"]))
+    parsed["last_updated"] = str(parsed["last_updated"])
+    parsed["score"] = str(parsed["score"])
+    parsed["votes"] = str(parsed["votes"])
+    parsed["tags"] = json.dumps(parsed["tags"])
+    parsed["unknown_tags"] = json.dumps(parsed["unknown_tags"])
+    parsed["previews_urls"] = json.dumps(parsed["previews_urls"])
+    parsed["downloads"] = json.dumps(parsed["downloads"])
+    parsed.update(reviews)
+    if meta_digest:
+        parsed[cache.HASHED_META] = meta_digest
+    return parsed
+
+
+async def thread_reviews(id: int, votes: int) -> dict[str, str] | f95zone.IndexerError:
+    # Reviews rarely change, only fetch them again once the thread
+    # shows a different review count or the cached ones expire
+    name = cache.REVIEWS_NAME_FORMAT.format(id=id)
+    cached = await codec.decode(await cache.redis.hgetall(name))
+    if cached.get("votes") == str(votes):
+        return {key: cached[key] for key in ("reviews_total", "reviews")}
 
     retries = 10
     while retries:
         async with f95zone.RATELIMIT:
             try:
                 async with f95zone.session.get(
-                    thread_url + "/br-reviews/",
+                    f95zone.THREAD_URL.format(thread=id) + "/br-reviews/",
                     cookies=f95zone.cookies,
                 ) as req:
                     if req.status == 429 and retries > 1:
-                        logger.warning("Hit a ratelimit, sleeping 2 seconds")
-                        await asyncio.sleep(2)
+                        # Slows down the shared ratelimit, next slot is further away
+                        logger.warning("Hit a ratelimit, slowing down")
+                        f95zone.F95ZONE_RATELIMITED.inc(kind="reviews")
+                        f95zone.RATELIMIT.throttled()
                         retries -= 1
                         continue
                     res = await req.read()
@@ -150,13 +163,16 @@ async def thread(id: int) -> dict[str, str] | f95zone.IndexerError | None:
                 raise
 
     if index_error := f95zone.check_error(res, logger):
+        if index_error is f95zone.ERROR_F95ZONE_RATELIMIT:
+            f95zone.RATELIMIT.throttled()
         return index_error
+    f95zone.RATELIMIT.succeeded()
 
     if not str(req.real_url).rstrip("/").endswith("br-reviews"):
         # Some threads have reviews disabled
         reviews = parser.ParsedReviews(total=0, items=[])
     else:
-        reviews = await loop.run_in_executor(None, parser.reviews, res)
+        reviews = await parsing.reviews(res)
         if isinstance(reviews, parser.ParserError):
             logger.error(
                 f"Thread {id} reviews parsing failed: {reviews.message}\n{reviews.dump}"
@@ -165,26 +181,183 @@ async def thread(id: int) -> dict[str, str] | f95zone.IndexerError | None:
 
         reviews.items = [dataclasses.asdict(review) for review in reviews.items]
 
-    # Prepare for redis, only strings allowed
-    parsed = dataclasses.asdict(ret)
-    if version:
-        parsed["version"] = version
-        del parsed["thread_version"]
-    else:
-        parsed["version"] = parsed["thread_version"]
-        # Leave thread_version set so cache knows to use a lower TTL,
-        # but only if the thread had a valid version detected
-        if not parsed["thread_version"]:
-            del parsed["thread_version"]
-    parsed["type"] = str(int(parsed["type"]))
-    parsed["status"] = str(int(parsed["status"]))
-    parsed["last_updated"] = str(parsed["last_updated"])
-    parsed["score"] = str(parsed["score"])
-    parsed["votes"] = str(parsed["votes"])
-    parsed["tags"] = json.dumps(parsed["tags"])
-    parsed["unknown_tags"] = json.dumps(parsed["unknown_tags"])
-    parsed["previews_urls"] = json.dumps(parsed["previews_urls"])
-    parsed["downloads"] = json.dumps(parsed["downloads"])
-    parsed["reviews_total"] = str(reviews.total)
-    parsed["reviews"] = json.dumps(reviews.items)
-    return parsed
+    result = {
+        "reviews_total": str(reviews.total),
+        "reviews": json.dumps(reviews.items),
+    }
+    async with cache.redis.pipeline(transaction=True) as pipeline:
+        pipeline.hset(name, mapping=codec.encode({**result, "votes": str(votes)}))
+        pipeline.expire(name, int(cache.REVIEWS_TTL))
+        await pipeline.execute()
+    return result
+
+
+async def latest_update(id: int, name: str) -> dict | f95zone.IndexerError | None:
+    # Watcher keeps the records it polled, only search for the ones it didn't see
+    if record := await cache.redis.get(cache.LATEST_NAME_FORMAT.format(id=id)):
+        return json.loads(record)
+
+    query = f95zone.latest_updates_search_sanitize_query(name)
+    for category in f95zone.LATEST_UPDATES_CATEGORIES:
+        try:
+            async with f95zone.session.get(
+                f95zone.LATEST_UPDATES_SEARCH_URL.format(
+                    cmd="list",
+                    cat=category,
+                    page=1,
+                    search="search",
+                    query=query,
+                    sort="likes",
+                    rows=90,
+                    ts=int(time.time()),
+                ),
+                cookies=f95zone.cookies,
+            ) as req:
+                res = await req.read()
+        except Exception as exc:
+            if index_error := f95zone.check_error(exc, logger):
+                return index_error
+            raise
+        if index_error := f95zone.check_error(res, logger):
+            return index_error
+        try:
+            updates = json.loads(res)
+        except Exception:
+            logger.error(f"Thread {id} search returned invalid JSON: {res}")
+            return f95zone.ERROR_UNKNOWN_RESPONSE
+        if index_error := f95zone.check_error(updates, logger):
+            return index_error
+
+        for update in updates["msg"]["data"]:
+            if update["thread_id"] == id:
+                record = {key: update[key] for key in cache.LATEST_FIELDS}
+                await cache.redis.set(
+                    cache.LATEST_NAME_FORMAT.format(id=id),
+                    json.dumps(record),
+                    ex=int(cache.LATEST_TTL),
+                )
+                return record
+
+    return None
+
+
+def prefetch_versions(ids: list[int]) -> None:
+    # Called by refresher with what is queued, one bulk check covers the next scrapes
+    now = time.monotonic()
+    for id, (_, fetched) in list(prefetched_versions.items()):
+        if now - fetched >= VERSION_PREFETCH_TTL:
+            del prefetched_versions[id]
+    ids = [
+        id for id in ids if id not in prefetched_versions and id not in prefetching
+    ][:VERSION_PREFETCH_SIZE]
+    if not ids:
+        return
+    prefetching.update(ids)
+    task = asyncio.create_task(_prefetch_versions(ids))
+    version_tasks.add(task)
+    task.add_done_callback(version_tasks.discard)
+
+
+async def _prefetch_versions(ids: list[int]) -> None:
+    try:
+        results = await _fetch_versions(ids)
+        # Errors are left for the scrape itself to run into and report
+        if not isinstance(results, f95zone.IndexerError):
+            now = time.monotonic()
+            prefetched_versions.update(
+                (id, (results.get(id, ""), now)) for id in ids if id in prefetching
+            )
+    except Exception:
+        logger.warning(f"Prefetching versions for {len(ids)} threads failed")
+    finally:
+        prefetching.difference_update(ids)
+
+
+def prefetched_version(id: int) -> str | None:
+    if cached := prefetched_versions.pop(id, None):
+        version, fetched = cached
+        if time.monotonic() - fetched < VERSION_PREFETCH_TTL:
+            return version
+    return None
+
+
+def forget_versions(ids: list[int]) -> None:
+    # Threads found outdated must not be scraped with a version checked before that
+    for id in ids:
+        prefetched_versions.pop(id, None)
+        prefetching.discard(id)
+
+
+async def thread_version(id: int) -> str | f95zone.IndexerError:
+    # Concurrent scrapes share one bulk version check, collected for a few ms
+    global version_batch
+    future = asyncio.get_running_loop().create_future()
+    version_waiters.setdefault(id, []).append(future)
+    if len(version_waiters) >= VERSION_BATCH_SIZE:
+        _flush_versions()
+    elif version_batch is None:
+        version_batch = asyncio.get_running_loop().call_later(
+            VERSION_BATCH_DELAY, _flush_versions
+        )
+    return await future
+
+
+def _flush_versions() -> None:
+    global version_batch
+    if version_batch is not None:
+        version_batch.cancel()
+        version_batch = None
+    waiters = dict(version_waiters)
+    version_waiters.clear()
+    # Keep a reference so the task isn't garbage collected midway
+    task = asyncio.create_task(_check_versions(waiters))
+    version_tasks.add(task)
+    task.add_done_callback(version_tasks.discard)
+
+
+async def _check_versions(waiters: dict[int, list[asyncio.Future]]) -> None:
+    try:
+        results = await _fetch_versions(list(waiters))
+    except Exception as exc:
+        for futures in waiters.values():
+            for future in futures:
+                if not future.done():
+                    future.set_exception(exc)
+        return
+    for id, futures in waiters.items():
+        result = results if isinstance(results, f95zone.IndexerError) else results.get(id, "")
+        for future in futures:
+            if not future.done():
+                future.set_result(result)
+
+
+async def _fetch_versions(ids: list[int]) -> dict[int, str] | f95zone.IndexerError:
+    logger.debug(f"Checking versions for {len(ids)} threads")
+    try:
+        async with f95zone.session.get(
+            f95zone.BULK_VERSION_CHECK_URL.format(threads=",".join(str(id) for id in ids)),
+        ) as req:
+            res = await req.read()
+    except Exception as exc:
+        if index_error := f95zone.check_error(exc, logger):
+            return index_error
+        raise
+    if index_error := f95zone.check_error(res, logger):
+        return index_error
+    try:
+        versions = json.loads(res)
+    except Exception:
+        logger.error(f"Versions for {len(ids)} threads returned invalid JSON: {res}")
+        return f95zone.ERROR_UNKNOWN_RESPONSE
+    if versions.get("msg") in ("Missing threads data", "Thread not found"):
+        versions["status"] = "ok"
+        versions["msg"] = {}
+    if index_error := f95zone.check_error(versions, logger):
+        return index_error
+
+    results = {}
+    for id in ids:
+        version = str(versions["msg"].get(str(id), ""))
+        if version != "Unknown":
+            results[id] = version
+    return results
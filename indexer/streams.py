@@ -0,0 +1,115 @@
+import asyncio
+import contextlib
+import datetime as dt
+import json
+import logging
+import typing
+
+from external import error
+from indexer import (
+    admission,
+    cache,
+    metrics,
+)
+
+STREAM_QUEUE_SIZE = 100
+STREAM_KEEPALIVE = dt.timedelta(seconds=30).total_seconds()
+STREAM_RETRY_DELAY = dt.timedelta(seconds=5).total_seconds()
+
+logger = logging.getLogger(__name__)
+subscribers: dict[int, set[asyncio.Queue]] = {}
+
+STREAM_CLIENTS = metrics.Gauge(
+    "indexer_stream_clients",
+    "Clients connected to the change stream",
+)
+STREAM_DROPPED = metrics.Counter(
+    "indexer_stream_dropped",
+    "Change stream clients dropped for falling behind",
+)
+
+
+@contextlib.asynccontextmanager
+async def lifespan():
+    listen_task = asyncio.create_task(listen())
+
+    try:
+        yield
+    finally:
+        listen_task.cancel()
+        # Let open streams end instead of waiting on a dead subscription
+        for queue in {queue for queues in subscribers.values() for queue in queues}:
+            close(queue)
+
+
+async def listen():
+    # One redis subscription per worker, fanned out to the clients connected to it
+    while True:
+        try:
+            async with cache.redis.pubsub() as pubsub:
+                await pubsub.subscribe(cache.CHANGES_CHANNEL)
+                async for message in pubsub.listen():
+                    if message["type"] != "message":
+                        continue
+                    id, last_change = message["data"].split(":")
+                    publish(int(id), int(last_change))
+        except Exception:
+            logger.error(f"Error listening for changes: {error.text()}\n{error.traceback()}")
+        # Changes were missed meanwhile, make clients reconnect and catch up
+        for queue in {queue for queues in subscribers.values() for queue in queues}:
+            close(queue)
+        await asyncio.sleep(STREAM_RETRY_DELAY)
+
+
+def publish(id: int, last_change: int) -> None:
+    for queue in list(subscribers.get(id, ())):
+        try:
+            queue.put_nowait((id, last_change))
+        except asyncio.QueueFull:
+            # Slow client, drop it and let it catch up with /changes on reconnect
+            STREAM_DROPPED.inc()
+            close(queue)
+
+
+def close(queue: asyncio.Queue) -> None:
+    while not queue.empty():
+        queue.get_nowait()
+    queue.put_nowait(None)
+
+
+@contextlib.contextmanager
+def subscribe(ids: set[int]):
+    queue = asyncio.Queue(STREAM_QUEUE_SIZE)
+    for id in ids:
+        subscribers.setdefault(id, set()).add(queue)
+    STREAM_CLIENTS.inc()
+    try:
+        yield queue
+    finally:
+        STREAM_CLIENTS.dec()
+        for id in ids:
+            if queues := subscribers.get(id):
+                queues.discard(queue)
+                if not queues:
+                    del subscribers[id]
+
+
+async def stream(ids: set[int], slot: admission.StreamSlot) -> typing.AsyncIterator[str]:
+    # Server-sent events, one {id: last_change} object per change
+    try:
+        with subscribe(ids) as queue:
+            yield ": subscribed\n\n"
+            while True:
+                await slot.refresh()
+                try:
+                    change = await asyncio.wait_for(queue.get(), STREAM_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    # Keep proxies and the client read timeout from closing idle streams
+                    yield ": keepalive\n\n"
+                    continue
+                if change is None:
+                    return
+                id, last_change = change
+                yield f"data: {json.dumps({id: last_change})}\n\n"
+    finally:
+        await slot.release()
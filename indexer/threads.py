@@ -1,21 +1,33 @@
-import asyncio
+import math
 import time
 
 import fastapi
 
 from indexer import (
+    admission,
     cache,
     f95zone,
+    responses,
+    streams,
 )
 
 FAST_MAX_IDS = 10
+FAST_BULK_MAX_IDS = 500
+CHANGES_MAX_IDS = 5000
+SUBSCRIBE_MAX_IDS = 10000
+FAST_IDS_PER_TOKEN = 100
 VALID_THREAD_IDS = range(1, 1_000_000)  # Top ID was ~232k at time of writing
+STALE_HEADER = "X-Index-Stale"
 
 router = fastapi.APIRouter()
 
 
 @router.get("/fast")
-async def fast_request(ids: str):
+async def fast_request(
+    request: fastapi.Request,
+    ids: str,
+    accept_encoding: str | None = fastapi.Header(None),
+):
     ids = ids.split(",")
     if len(ids) > FAST_MAX_IDS:
         return fastapi.responses.JSONResponse(
@@ -31,23 +43,163 @@ async def fast_request(ids: str):
             status_code=400,
         )
 
+    if limited := await admission.admit(request):
+        return limited
+
+    return await _fast_response(ids, accept_encoding)
+
+
+@router.post("/fast")
+async def fast_bulk_request(request: fastapi.Request):
+    try:
+        ids = await request.json()
+    except ValueError:
+        ids = None
+    if not isinstance(ids, list):
+        return fastapi.responses.JSONResponse(
+            "Body must be a JSON array of IDs",
+            status_code=400,
+        )
+
+    if len(ids) > FAST_BULK_MAX_IDS:
+        return fastapi.responses.JSONResponse(
+            f"Max {FAST_BULK_MAX_IDS} IDs",
+            status_code=400,
+        )
+
+    if any(type(id) is not int for id in ids):
+        return fastapi.responses.JSONResponse(
+            "IDs must be numeric",
+            status_code=400,
+        )
+
+    # Bulk checks cost more, but less than the same IDs in single requests
+    if limited := await admission.admit(request, math.ceil(len(ids) / FAST_IDS_PER_TOKEN)):
+        return limited
+
+    return await _fast_response(set(ids), request.headers.get("Accept-Encoding"))
+
+
+async def _fast_response(ids: set[int], accept_encoding: str | None):
     if any(id not in VALID_THREAD_IDS for id in ids):
         return fastapi.responses.JSONResponse(
             "Invalid thread IDs",
             status_code=400,
         )
 
-    tasks = [cache.last_change(id) for id in ids]
-    last_changes = await asyncio.gather(*tasks)
-    results = dict(zip(ids, last_changes))
-    return fastapi.responses.JSONResponse(
+    results, stale = await cache.last_changes(list(ids))
+
+    headers = {}
+    if stale:
+        headers[STALE_HEADER] = ",".join(str(id) for id in sorted(stale))
+
+    return responses.json_response(
         results,
         status_code=200,
+        encoding=responses.negotiate_encoding(accept_encoding),
+        headers=headers,
+    )
+
+
+@router.get("/changes")
+async def changes_request(
+    request: fastapi.Request,
+    since: int,
+    cursor: str = "",
+    accept_encoding: str | None = fastapi.Header(None),
+):
+    # Future timestamps are fine here, client clocks can be ahead
+    if since < 0:
+        return fastapi.responses.JSONResponse(
+            "Invalid timestamp",
+            status_code=400,
+        )
+
+    # Cursor is the last change of the previous page, picks up right after it
+    if cursor:
+        try:
+            since = int(cursor)
+        except ValueError:
+            return fastapi.responses.JSONResponse(
+                "Invalid cursor",
+                status_code=400,
+            )
+
+    # Charged like a bulk /fast of a full page, that is what a page can cost to build
+    if limited := await admission.admit(request, math.ceil(CHANGES_MAX_IDS / FAST_IDS_PER_TOKEN)):
+        return limited
+
+    # Only reads the last change index, expired threads are not refreshed here,
+    # so clients should still do a full /fast check once in a while
+    changes, cursor = await cache.changes_since(since, CHANGES_MAX_IDS)
+
+    return responses.json_response(
+        {
+            "changes": changes,
+            "cursor": str(cursor) if cursor is not None else None,
+            "now": int(time.time()),
+        },
+        status_code=200,
+        encoding=responses.negotiate_encoding(accept_encoding),
+    )
+
+
+@router.post("/subscribe")
+async def subscribe_request(request: fastapi.Request):
+    try:
+        ids = await request.json()
+    except ValueError:
+        ids = None
+    if not isinstance(ids, list):
+        return fastapi.responses.JSONResponse(
+            "Body must be a JSON array of IDs",
+            status_code=400,
+        )
+
+    if len(ids) > SUBSCRIBE_MAX_IDS:
+        return fastapi.responses.JSONResponse(
+            f"Max {SUBSCRIBE_MAX_IDS} IDs",
+            status_code=400,
+        )
+
+    if any(type(id) is not int for id in ids):
+        return fastapi.responses.JSONResponse(
+            "IDs must be numeric",
+            status_code=400,
+        )
+
+    if any(id not in VALID_THREAD_IDS for id in ids):
+        return fastapi.responses.JSONResponse(
+            "Invalid thread IDs",
+            status_code=400,
+        )
+
+    if limited := await admission.admit(request, math.ceil(len(ids) / FAST_IDS_PER_TOKEN)):
+        return limited
+    slot = admission.StreamSlot(request)
+    if limited := await slot.acquire():
+        return limited
+
+    # Only pushes changes from now on, clients catch up with /changes after connecting
+    return fastapi.responses.StreamingResponse(
+        streams.stream(set(ids), slot),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",
+        },
     )
 
 
 @router.get("/full/{id}")
-async def full_request(id: int, ts: int):
+async def full_request(
+    request: fastapi.Request,
+    id: int,
+    ts: int,
+    format: str = responses.FORMAT_JSON,
+    if_none_match: str | None = fastapi.Header(None),
+    accept_encoding: str | None = fastapi.Header(None),
+):
     if id not in VALID_THREAD_IDS:
         return fastapi.responses.JSONResponse(
             "Invalid thread ID",
@@ -62,6 +214,26 @@ async def full_request(id: int, ts: int):
             status_code=406,
         )
 
+    if format not in responses.FORMATS:
+        return fastapi.responses.JSONResponse(
+            "Invalid format",
+            status_code=400,
+        )
+
+    if limited := await admission.admit(request):
+        return limited
+
+    # Last change is bumped on any meaningful change, so it makes a strong ETag
+    last_change = await cache.last_change(id)
+    etag = f'"{last_change}"'
+    if format != responses.FORMAT_JSON:
+        etag = f'"{last_change}-{format}"'
+    if if_none_match and responses.etag_matches(if_none_match, etag):
+        return fastapi.responses.Response(
+            status_code=304,
+            headers={"ETag": etag},
+        )
+
     full = await cache.get_thread(id)
 
     status = 200
@@ -71,7 +243,19 @@ async def full_request(id: int, ts: int):
         else:
             status = 500
 
-    return fastapi.responses.JSONResponse(
+    headers = {}
+    if status == 200:
+        headers["ETag"] = etag
+    if cache.is_stale(full):
+        headers[STALE_HEADER] = "1"
+
+    return responses.json_response(
         full,
         status_code=status,
+        encoding=responses.negotiate_encoding(accept_encoding),
+        headers=headers,
+        raw_fields=(
+            cache.JSON_FIELDS if format == responses.FORMAT_STRUCTURED else ()
+        ),
     )
+
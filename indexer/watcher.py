@@ -1,37 +1,125 @@
 import asyncio
 import contextlib
 import datetime as dt
-import hashlib
+import itertools
 import json
 import logging
+import math
+import os
 import time
 
-from common import parser
 from external import error
 from indexer import (
     cache,
     f95zone,
+    metrics,
+    refresher,
+    scraper,
 )
 
 WATCH_UPDATES_INTERVAL = dt.timedelta(minutes=5).total_seconds()
 WATCH_UPDATES_CATEGORIES = f95zone.LATEST_UPDATES_CATEGORIES
 WATCH_UPDATES_PAGES = 4
+WATCH_UPDATES_MAX_PAGES = 25
+WATCH_UPDATES_CONCURRENCY = 4
+WATCH_UPDATES_HIGH_WATER = "watcher:updates"
 WATCH_VERSIONS_INTERVAL = dt.timedelta(hours=12).total_seconds()
+WATCH_VERSIONS_TICK = dt.timedelta(minutes=1).total_seconds()
 WATCH_VERSIONS_CHUNK_SIZE = 1000
+WATCH_VERSIONS_CONCURRENCY = 2
+WATCH_VERSIONS_SWEEP = "watcher:versions"
+WATCH_REFRESH_MAX = 1000
+WATCH_LEADER_LOCK = "lock:watcher"
+WATCH_LEADER_TIMEOUT = dt.timedelta(minutes=1).total_seconds()
 
 logger = logging.getLogger(__name__)
+leader = False
+updates_concurrency = WATCH_UPDATES_CONCURRENCY
+versions_concurrency = WATCH_VERSIONS_CONCURRENCY
+
+WATCH_POLL_SECONDS = metrics.Histogram(
+    "indexer_watch_poll_seconds",
+    "Duration of watcher poll cycles",
+    labels=("kind",),
+    buckets=(1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600),
+)
+WATCH_INVALIDATED = metrics.Counter(
+    "indexer_watch_invalidated",
+    "Cached threads invalidated by the watcher",
+    labels=("kind",),
+)
+WATCH_REFRESHED = metrics.Counter(
+    "indexer_watch_refreshed",
+    "Invalidated threads queued by the watcher for refresh before clients ask",
+    labels=("kind",),
+)
 
 
 @contextlib.asynccontextmanager
 async def lifespan():
+    global updates_concurrency, versions_concurrency
+    updates_concurrency = int(
+        os.environ.get("WATCH_UPDATES_CONCURRENCY", WATCH_UPDATES_CONCURRENCY)
+    )
+    versions_concurrency = int(
+        os.environ.get("WATCH_VERSIONS_CONCURRENCY", WATCH_VERSIONS_CONCURRENCY)
+    )
+    leader_task = asyncio.create_task(watch_leader())
     updates_task = asyncio.create_task(watch_updates())
     versions_task = asyncio.create_task(watch_versions())
+    summary_task = asyncio.create_task(watch_summary())
 
     try:
         yield
     finally:
+        leader_task.cancel()
         updates_task.cancel()
         versions_task.cancel()
+        summary_task.cancel()
+
+
+async def watch_leader():
+    # Only one worker across all hosts should poll F95zone
+    global leader
+    lock = cache.redis.lock(
+        WATCH_LEADER_LOCK,
+        timeout=WATCH_LEADER_TIMEOUT,
+        thread_local=False,
+    )
+    try:
+        while True:
+            try:
+                if leader and await lock.owned():
+                    await lock.reacquire()
+                else:
+                    leader = await lock.acquire(blocking=False)
+                    if leader:
+                        logger.info("Became watcher leader")
+            except Exception:
+                leader = False
+                logger.error(f"Error electing watcher leader: {error.text()}\n{error.traceback()}")
+            await asyncio.sleep(WATCH_LEADER_TIMEOUT / 3)
+    finally:
+        if leader:
+            leader = False
+            with contextlib.suppress(Exception):
+                await lock.release()
+
+
+async def watch_summary():
+    await asyncio.sleep(10)
+
+    while True:
+        if leader:
+            try:
+                await cache.summarize()
+            except Exception:
+                logger.error(f"Error summarizing cache: {error.text()}\n{error.traceback()}")
+        else:
+            # Gauges add up across workers, only the leader's count
+            cache.CACHE_THREADS.values.clear()
+            cache.CACHE_EXPIRING.values.clear()
+        await asyncio.sleep(cache.SUMMARY_INTERVAL)
 
 
 # https://stackoverflow.com/a/312464
@@ -40,107 +128,165 @@ def chunks(lst, n):
         yield lst[i : i + n]
 
 
+async def fetch_updates(category: str, page: int, slots: asyncio.Semaphore) -> list[dict]:
+    async with slots:
+        logger.info(f"Poll category {category} page {page}")
+
+        try:
+            async with f95zone.session.get(
+                f95zone.LATEST_UPDATES_URL.format(
+                    cmd="list",
+                    cat=category,
+                    page=page,
+                    sort="date",
+                    rows=90,
+                    ts=int(time.time()),
+                ),
+                cookies=f95zone.cookies,
+            ) as req:
+                res = await req.read()
+        except Exception as exc:
+            if index_error := f95zone.check_error(exc, logger):
+                raise Exception(index_error)
+            raise
+
+    if index_error := f95zone.check_error(res, logger):
+        raise Exception(index_error)
+
+    try:
+        updates = json.loads(res)
+    except Exception:
+        raise Exception(f"Latest updates returned invalid JSON: {res}")
+    if index_error := f95zone.check_error(updates, logger):
+        raise Exception(index_error)
+
+    return updates["msg"]["data"]
+
+
+async def poll_category(
+    category: str, high_water: int, slots: asyncio.Semaphore
+) -> tuple[list[dict], int]:
+    # Pages are sorted by date, so stop once past what the last cycle already saw,
+    # after downtime this keeps paging deeper until it catches up to that point
+    max_pages = WATCH_UPDATES_MAX_PAGES if high_water else WATCH_UPDATES_PAGES
+    updates = []
+    for page in range(1, max_pages + 1):
+        data = await fetch_updates(category, page, slots)
+        updates += data
+        if not data or (high_water and min(update["ts"] for update in data) < high_water):
+            break
+    else:
+        if high_water:
+            logger.warning(
+                f"Updates: Category {category} did not catch up after {max_pages} pages"
+            )
+    return updates, page
+
+
 async def poll_updates():
     try:
         logger.info("Poll updates start")
+        start = time.perf_counter()
+
+        high_water = await cache.redis.hmget(
+            WATCH_UPDATES_HIGH_WATER, WATCH_UPDATES_CATEGORIES
+        )
+
+        # Latest updates are not ratelimited like threads, fetch a few categories at once
+        slots = asyncio.Semaphore(updates_concurrency)
+        tasks = [
+            asyncio.create_task(poll_category(category, int(ts or 0), slots))
+            for category, ts in zip(WATCH_UPDATES_CATEGORIES, high_water)
+        ]
+        try:
+            categories = await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+        # We compare version strings to detect updates
+        # But also make a hash of other attributes to detect metadata changes
+        # We don't save these values directly because we parse from thread content instead
+        # But using this meta hash allows to discover metadata changes sooner
+        current_data = {}
+        latest_records = cache.redis.pipeline()
+        for updates, _ in categories:
+            for update in updates:
+                id = update["thread_id"]
+                name = cache.NAME_FORMAT.format(id=id)
+                if name in current_data:
+                    # Shifted to the next page while polling, first one is newer
+                    continue
+                version = str(update["version"])
+                if version == "Unknown":
+                    version = None
+                meta = cache.meta_digest(update)
+                current_data[name] = (id, version, meta)
+                # Keep what scraper needs, saves it searching latest updates per thread
+                latest_records.set(
+                    cache.LATEST_NAME_FORMAT.format(id=id),
+                    json.dumps({key: update[key] for key in cache.LATEST_FIELDS}),
+                    ex=int(cache.LATEST_TTL),
+                )
+
+        # Saved before invalidating, so refreshes already find the new records
+        if len(latest_records):
+            await latest_records.execute()
+
+        # One round trip for the whole cycle instead of one per page
+        cached_data = cache.redis.pipeline()
+        for name in current_data:
+            cached_data.hmget(name, "version", cache.HASHED_META, cache.LAST_CACHED)
+        cached_data = await cached_data.execute()
 
         invalidate_cache = cache.redis.pipeline()
-
-        for category in WATCH_UPDATES_CATEGORIES:
-            for page in range(1, WATCH_UPDATES_PAGES + 1):
-                logger.info(f"Poll category {category} page {page}")
-
-                cached_data = cache.redis.pipeline()
-
-                try:
-                    async with f95zone.session.get(
-                        f95zone.LATEST_UPDATES_URL.format(
-                            cmd="list",
-                            cat=category,
-                            page=page,
-                            sort="date",
-                            rows=90,
-                            ts=int(time.time()),
-                        ),
-                        cookies=f95zone.cookies,
-                    ) as req:
-                        res = await req.read()
-                except Exception as exc:
-                    if index_error := f95zone.check_error(exc, logger):
-                        raise Exception(index_error)
-                    raise
-
-                if index_error := f95zone.check_error(res, logger):
-                    raise Exception(index_error)
-
-                try:
-                    updates = json.loads(res)
-                except Exception:
-                    raise Exception(f"Latest updates returned invalid JSON: {res}")
-                if index_error := f95zone.check_error(updates, logger):
-                    raise Exception(index_error)
-
-                # We compare version strings to detect updates
-                # But also make a hash of other attributes to detect metadata changes
-                # We don't save these values directly because we parse from thread content instead
-                # But using this meta hash allows to discover metadata changes sooner
-                names = []
-                current_data = []
-                for update in updates["msg"]["data"]:
-                    name = cache.NAME_FORMAT.format(id=update["thread_id"])
-                    names.append(name)
-                    cached_data.hmget(
-                        name, "version", cache.HASHED_META, cache.LAST_CACHED
-                    )
-                    version = str(update["version"])
-                    if version == "Unknown":
-                        version = None
-                    meta = (
-                        update["title"],
-                        update["creator"],
-                        update["prefixes"],
-                        update["tags"],
-                        round(update["rating"], 1),
-                        update["cover"],
-                        update["screens"],
-                        parser.datestamp(update["ts"]),
+        invalidated_ids = []
+        assert len(current_data) == len(cached_data)
+        for (
+            (name, (id, version, meta)),
+            (cached_version, cached_meta, last_cached),
+        ) in zip(current_data.items(), cached_data):
+            if cached_version is None or not last_cached:
+                continue
+
+            version_outdated = version and version != cached_version
+            meta_outdated = meta != cached_meta
+
+            if version_outdated or meta_outdated:
+                cache.invalidate(invalidate_cache, id)
+                invalidated_ids.append(id)
+                invalidate_cache.hset(name, cache.HASHED_META, meta)
+                logger.info(
+                    f"Updates: Invalidating cache for {name}"
+                    + (
+                        f" ({cached_version!r} -> {version!r})"
+                        if version_outdated
+                        else " (meta changed)"
                     )
-                    meta = hashlib.md5(json.dumps(meta).encode()).hexdigest()
-                    current_data.append((version, meta))
-
-                cached_data = await cached_data.execute()
-
-                assert len(names) == len(current_data) == len(cached_data)
-                for (
-                    name,
-                    (version, meta),
-                    (cached_version, cached_meta, last_cached),
-                ) in zip(names, current_data, cached_data):
-                    if cached_version is None or not last_cached:
-                        continue
-
-                    version_outdated = version and version != cached_version
-                    meta_outdated = meta != cached_meta
-
-                    if version_outdated or meta_outdated:
-                        invalidate_cache.hdel(name, cache.LAST_CACHED)
-                        invalidate_cache.hset(name, cache.HASHED_META, meta)
-                        logger.info(
-                            f"Updates: Invalidating cache for {name}"
-                            + (
-                                f" ({cached_version!r} -> {version!r})"
-                                if version_outdated
-                                else " (meta changed)"
-                            )
-                        )
+                )
 
         if len(invalidate_cache):
             result = await invalidate_cache.execute()
-            # Skip every 2nd result, those are setting HASHED_META
-            invalidated = sum(ret != "0" for ret in result[::2])
-            logger.info(f"Updates: Invalidated cache for {invalidated} threads")
-
-        logger.info("Poll updates done")
+            # Only every 3rd result, the others are the index and HASHED_META
+            invalidated = [id for id, ret in zip(invalidated_ids, result[::3]) if ret != 0]
+            WATCH_INVALIDATED.inc(len(invalidated), kind="updates")
+            logger.info(f"Updates: Invalidated cache for {len(invalidated)} threads")
+            await refresh_invalidated(invalidated, "updates")
+
+        # Only move forward once the whole cycle made it through
+        if high_water := {
+            category: max(update["ts"] for update in updates)
+            for category, (updates, _) in zip(WATCH_UPDATES_CATEGORIES, categories)
+            if updates
+        }:
+            await cache.redis.hset(WATCH_UPDATES_HIGH_WATER, mapping=high_water)
+
+        duration = time.perf_counter() - start
+        WATCH_POLL_SECONDS.observe(duration, kind="updates")
+        logger.info(
+            f"Poll updates done in {duration:.1f}s"
+            f" ({sum(pages for _, pages in categories)} pages, {len(current_data)} threads)"
+        )
 
     except Exception as exc:
         if (
@@ -162,85 +308,160 @@ async def poll_updates():
             logger.error(f"Error polling updates: {error.text()}\n{error.traceback()}")
 
 
+async def refresh_invalidated(ids: list[int], kind: str) -> None:
+    # Clients check right after a game updates, have it scraped before they ask
+    if not ids:
+        return
+    scraper.forget_versions(ids)
+    accessed = await cache.redis.zmscore(cache.INDEX_ACCESS, ids)
+    # Most recently requested first, rest get refreshed when asked for
+    ids = [
+        id
+        for _, id in sorted(
+            zip((access or 0 for access in accessed), ids), reverse=True
+        )[:WATCH_REFRESH_MAX]
+    ]
+    for id in ids:
+        refresher.enqueue(id, refresher.PRIORITY_UPDATED)
+    WATCH_REFRESHED.inc(len(ids), kind=kind)
+
+
 async def watch_updates():
     await asyncio.sleep(10)
 
     while True:
-        asyncio.run_coroutine_threadsafe(poll_updates(), asyncio.get_running_loop())
+        if leader:
+            asyncio.run_coroutine_threadsafe(poll_updates(), asyncio.get_running_loop())
         await asyncio.sleep(WATCH_UPDATES_INTERVAL)
 
 
-async def poll_versions():
-    try:
-        logger.info("Poll versions start")
-
-        names = [n async for n in cache.redis.scan_iter("thread:*", 10000, "hash")]
-        invalidate_cache = cache.redis.pipeline()
-
-        for names_chunk in chunks(names, WATCH_VERSIONS_CHUNK_SIZE):
-            cached_data = cache.redis.pipeline()
-            csv = ""
-            ids = []
-            for name in names_chunk:
-                cached_data.hmget(name, "version", cache.LAST_CACHED)
-                id = name.split(":")[1]
-                csv += f"{id},"
-                ids.append(id)
-            csv = csv.strip(",")
+async def check_versions(names_chunk: list[str], slots: asyncio.Semaphore) -> list[tuple[str, str, str]]:
+    cached_data = cache.redis.pipeline()
+    csv = ""
+    ids = []
+    for name in names_chunk:
+        cached_data.hmget(name, "version", cache.LAST_CACHED)
+        id = name.split(":")[1]
+        csv += f"{id},"
+        ids.append(id)
+    csv = csv.strip(",")
+
+    async with slots:
+        try:
+            async with f95zone.session.get(
+                f95zone.BULK_VERSION_CHECK_URL.format(threads=csv),
+            ) as req:
+                # Await together for efficiency
+                res, cached_data = await asyncio.gather(
+                    req.read(), cached_data.execute()
+                )
+        except Exception as exc:
+            if index_error := f95zone.check_error(exc, logger):
+                raise Exception(index_error)
+            raise
 
-            try:
-                async with f95zone.session.get(
-                    f95zone.BULK_VERSION_CHECK_URL.format(threads=csv),
-                ) as req:
-                    # Await together for efficiency
-                    res, cached_data = await asyncio.gather(
-                        req.read(), cached_data.execute()
-                    )
-            except Exception as exc:
-                if index_error := f95zone.check_error(exc, logger):
-                    raise Exception(index_error)
-                raise
+    if index_error := f95zone.check_error(res, logger):
+        raise Exception(index_error)
 
-            if index_error := f95zone.check_error(res, logger):
-                raise Exception(index_error)
+    try:
+        versions = json.loads(res)
+    except Exception:
+        raise Exception(f"Versions API returned invalid JSON: {res}")
+    if versions.get("msg") in (
+        "Missing threads data",
+        "Thread not found",
+    ):
+        versions["status"] = "ok"
+        versions["msg"] = {}
+    if index_error := f95zone.check_error(versions, logger):
+        raise Exception(index_error)
+    versions = versions["msg"]
+
+    outdated = []
+    assert len(names_chunk) == len(ids) == len(cached_data)
+    for name, id, (cached_version, last_cached) in zip(
+        names_chunk, ids, cached_data
+    ):
+        if cached_version is None or not last_cached:
+            continue
+        version = versions.get(id)
+        if not version or version == "Unknown":
+            continue
+
+        if version != cached_version:
+            outdated.append((name, cached_version, version))
+    return outdated
 
-            try:
-                versions = json.loads(res)
-            except Exception:
-                raise Exception(f"Versions API returned invalid JSON: {res}")
-            if versions.get("msg") in (
-                "Missing threads data",
-                "Thread not found",
-            ):
-                versions["status"] = "ok"
-                versions["msg"] = {}
-            if index_error := f95zone.check_error(versions, logger):
-                raise Exception(index_error)
-            versions = versions["msg"]
 
-            assert len(names_chunk) == len(ids) == len(cached_data)
-            for name, id, (cached_version, last_cached) in zip(
-                names_chunk, ids, cached_data
-            ):
-                if cached_version is None or not last_cached:
-                    continue
-                version = versions.get(id)
-                if not version or version == "Unknown":
-                    continue
+async def poll_versions():
+    try:
+        start = time.perf_counter()
+
+        # Sweep state survives restarts, so a new leader picks up where the last one was
+        sweep = await cache.redis.hgetall(WATCH_VERSIONS_SWEEP)
+        cursor = int(sweep.get("cursor", 0))
+        sweep_start = float(sweep.get("start", 0))
+        seen = int(sweep.get("seen", 0))
+        if not sweep_start:
+            logger.info("Versions: Sweep start")
+            sweep_start = time.time()
+
+        # Spread one full sweep over the interval, a slice of threads each tick,
+        # walking the ID index so the cursor is simply the last ID checked
+        ticks = WATCH_VERSIONS_INTERVAL / WATCH_VERSIONS_TICK
+        slice_size = max(1, math.ceil(await cache.redis.zcard(cache.INDEX_IDS) / ticks))
+        ids = await cache.redis.zrangebyscore(
+            cache.INDEX_IDS, f"({cursor}", "+inf", start=0, num=slice_size
+        )
+        names = [cache.NAME_FORMAT.format(id=id) for id in ids]
+        cursor = int(ids[-1]) if len(ids) == slice_size else 0
+
+        slots = asyncio.Semaphore(versions_concurrency)
+        tasks = [
+            asyncio.create_task(check_versions(names_chunk, slots))
+            for names_chunk in chunks(names, WATCH_VERSIONS_CHUNK_SIZE)
+        ]
+        try:
+            outdated = await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
 
-                if version != cached_version:
-                    invalidate_cache.hdel(name, cache.LAST_CACHED)
-                    logger.warning(
-                        f"Versions: Invalidating cache for {name}"
-                        f" ({cached_version!r} -> {version!r})"
-                    )
+        invalidate_cache = cache.redis.pipeline()
+        invalidated_ids = []
+        for name, cached_version, version in itertools.chain(*outdated):
+            cache.invalidate(invalidate_cache, int(name.split(":")[1]))
+            invalidated_ids.append(int(name.split(":")[1]))
+            logger.warning(
+                f"Versions: Invalidating cache for {name}"
+                f" ({cached_version!r} -> {version!r})"
+            )
 
         if len(invalidate_cache):
             result = await invalidate_cache.execute()
-            invalidated = sum(ret != "0" for ret in result)
-            logger.warning(f"Versions: Invalidated cache for {invalidated} threads")
+            # Only every 2nd result, the others are the index
+            invalidated = [id for id, ret in zip(invalidated_ids, result[::2]) if ret != 0]
+            WATCH_INVALIDATED.inc(len(invalidated), kind="versions")
+            logger.warning(f"Versions: Invalidated cache for {len(invalidated)} threads")
+            await refresh_invalidated(invalidated, "versions")
+
+        seen += len(names)
+        if cursor == 0:
+            await cache.redis.hset(
+                WATCH_VERSIONS_SWEEP,
+                mapping={"cursor": 0, "start": 0, "seen": 0},
+            )
+            logger.info(
+                f"Versions: Sweep done in {time.time() - sweep_start:.0f}s"
+                f" ({seen} threads)"
+            )
+        else:
+            await cache.redis.hset(
+                WATCH_VERSIONS_SWEEP,
+                mapping={"cursor": cursor, "start": sweep_start, "seen": seen},
+            )
 
-        logger.info("Poll versions done")
+        WATCH_POLL_SECONDS.observe(time.perf_counter() - start, kind="versions")
 
     except Exception as exc:
         if (
@@ -266,5 +487,7 @@ async def watch_versions():
     await asyncio.sleep(20)
 
     while True:
-        asyncio.run_coroutine_threadsafe(poll_versions(), asyncio.get_running_loop())
-        await asyncio.sleep(WATCH_VERSIONS_INTERVAL)
+        if leader:
+            # Awaited, ticks share the sweep cursor so they must not overlap
+            await poll_versions()
+        await asyncio.sleep(WATCH_VERSIONS_TICK)
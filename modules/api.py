@@ -22,10 +22,10 @@ import zipfile
 import aiofiles
 import aiohttp
 import aiohttp_socks
-import aiolimiter
 import desktop_notifier
 import imgui
 import python_socks
+import zstd
 
 from common.structs import (
     CounterContext,
@@ -43,7 +43,10 @@ from common.structs import (
     TimelineEventType,
     Type,
 )
-from common import parser
+from common import (
+    parser,
+    ratelimit,
+)
 from external import (
     async_thread,
     error,
@@ -108,9 +111,19 @@ f95_temp_error_messages = (
 )
 
 api_host = os.environ.get("F95INDEXER_URL") or "https://api.f95checker.dev"
-api_fast_check_url = api_host + "/fast?ids={ids}"
-api_full_check_url = api_host + "/full/{id}?ts={ts}"
-api_fast_check_max_ids = 10
+api_fast_check_url = api_host + "/fast"
+api_full_check_url = api_host + "/full/{id}?ts={ts}&format=structured"
+api_changes_url = api_host + "/changes?since={since}&cursor={cursor}"
+api_subscribe_url = api_host + "/subscribe"
+api_fast_check_max_ids = 500
+api_full_refresh_interval = 24 * 60 * 60  # Check whole library at least daily, changes feed in between
+api_changes_overlap = 10 * 60  # Ask a bit further back than needed, changes are deduplicated anyway
+api_stream_max_ids = 10000
+api_stream_read_timeout = 90  # Cache API sends a keepalive every 30 seconds
+api_stream_retry_max = 5 * 60
+api_busy_retries = 5  # Cache API answers 429 with Retry-After when a client sends too much at once
+api_busy_retry_max = 60
+api_accept_encoding = "zstd, gzip"
 
 app_update_endpoint = "https://api.github.com/repos/WillyJL/F95Checker/releases/latest"
 
@@ -122,14 +135,15 @@ updating = False
 session: aiohttp.ClientSession = None
 ssl_context: ssl.SSLContext = None
 temp_prefix = "F95Checker-Temp-"
-f95_ratelimit = aiolimiter.AsyncLimiter(max_rate=1, time_period=2)
-f95_ratelimit_sleeping = CounterContext()
+# Starts at one request every 2 seconds, speeds up while F95zone allows it
+f95_ratelimit = ratelimit.AdaptiveLimiter(ratelimit.AdaptiveRate(rate=0.5, min_rate=1 / 30, max_rate=1))
 fast_checks_sem: asyncio.Semaphore = None
 full_checks_sem: asyncio.Semaphore = None
 fast_checks_counter = 0
 full_checks_counter = CounterContext()
 images_counter = CounterContext()
 downloads: dict[str, FileDownload] = {}
+stream_pending: set[int] = set()
 
 
 def make_session():
@@ -257,14 +271,13 @@ async def request(method: str, url: str, read=True, cookies: dict = True, **kwar
         cookies = {}
     is_ratelimit_request = url.startswith(f95_host) and not url.startswith(f95_no_ratelimit_urls)
     ratelimit_retries = 10
-    ratelimit_sleep = 0
+    busy_retries = api_busy_retries if url.startswith(api_host) else 0
     _can_ratelimit = lambda: is_ratelimit_request and ratelimit_retries > 1
-    async def _do_ratelimit():
-        nonlocal ratelimit_retries, ratelimit_sleep
+    def _do_ratelimit():
+        nonlocal ratelimit_retries
         ratelimit_retries -= 1
-        with f95_ratelimit_sleeping:
-            ratelimit_sleep += 5
-            await asyncio.sleep(ratelimit_sleep)
+        # Retry goes through the limiter again, which now waits longer
+        f95_ratelimit.throttled()
     while retries and ratelimit_retries:
         try:
             # Only ratelimit when connecting to F95zone
@@ -280,15 +293,28 @@ async def request(method: str, url: str, read=True, cookies: dict = True, **kwar
                 **kwargs
             ) as req:
                 if _can_ratelimit() and req.status == 429:
-                    await _do_ratelimit()
+                    _do_ratelimit()
+                    continue
+                if busy_retries and req.status == 429:
+                    busy_retries -= 1
+                    try:
+                        retry_after = float(req.headers.get("Retry-After", 1))
+                    except ValueError:
+                        retry_after = 1
+                    req.release()
+                    await asyncio.sleep(min(retry_after, api_busy_retry_max))
                     continue
                 if not read:
+                    if is_ratelimit_request:
+                        f95_ratelimit.succeeded()
                     yield b"", req
                     break
                 res = await req.read()
                 if _can_ratelimit() and any(msg in res for msg in f95_ratelimit_forum_errors):
-                    await _do_ratelimit()
+                    _do_ratelimit()
                     continue
+                if is_ratelimit_request:
+                    f95_ratelimit.succeeded()
                 yield res, req
             break
         except (aiohttp.ClientError, asyncio.TimeoutError) as exc:
@@ -391,6 +417,20 @@ def raise_f95zone_error(res: bytes | dict, return_login=False):
         return True
 
 
+def api_decode(res: bytes, req: aiohttp.ClientResponse):
+    # Aiohttp only decompresses gzip, deflate and brotli by itself
+    if req.headers.get("Content-Encoding") == "zstd":
+        res = zstd.decompress(res)
+    return res
+
+
+def api_nested(value: str | list | dict):
+    # Older Cache API versions send nested data as JSON strings
+    if isinstance(value, str):
+        return json.loads(value)
+    return value
+
+
 def raise_api_error(res: bytes | dict):
     if isinstance(res, bytes):
         if any(msg in res for msg in (
@@ -403,6 +443,13 @@ def raise_api_error(res: bytes | dict):
                 "please retry in a few minutes.",
                 MsgBox.warn
             )
+        if res.startswith(b'"Too many requests'):
+            raise msgbox.Exc(
+                "Too many requests",
+                "F95Checker Cache API is receiving too many requests from you,\n"
+                "please retry in a few minutes.",
+                MsgBox.warn
+            )
         return True
     elif isinstance(res, dict):
         if index_error := res.get("INDEX_ERROR"):
@@ -767,6 +814,98 @@ def last_check_before(before_version: str, checked_version: str):
     return is_before
 
 
+def needs_full_data(game: Game):
+    check_new_enums = False
+    if globals.version != game.last_check_version:
+        check_new_enums = (
+            Tag.unknown in game.tags or
+            game.type is Type.Unknown or
+            game.status is Status.Unknown
+        )
+
+    # Reasons to process full data again even if the API has nothing new
+    return (
+        check_new_enums or
+        game.status is Status.Unchecked or
+        (game.image.missing and (game.image_url.startswith("http") or not game.image_url)) or
+        last_check_before("10.1.1", game.last_check_version)  # Switch away from HEAD requests, new version parsing
+    )
+
+
+async def fetch_changes(since: int):
+    changes: dict[int, int] = {}
+    cursor = ""
+    now = None
+    while True:
+        res = None
+        try:
+            async with request("GET", api_changes_url.format(since=since, cursor=cursor), headers={"Accept-Encoding": api_accept_encoding}, timeout=120, cookies=False) as (res, req):
+                res = api_decode(res, req)
+            raise_api_error(res)
+            page = json.loads(res)
+            raise_api_error(page)
+            changes.update((int(id), last_changed) for id, last_changed in page["changes"].items())
+        except Exception as exc:
+            if isinstance(exc, msgbox.Exc) or not res:
+                raise exc
+            raise msgbox.Exc(
+                "Changes check error",
+                "Something went wrong checking for changes:\n"
+                f"{error.text()}\n"
+                "\n"
+                "Click below to see the response body and traceback.\n"
+                "Please submit a bug report on F95zone or GitHub including these.",
+                MsgBox.error,
+                more=f"Response body:\n{str(res)[:10000]}\n\n{error.traceback()}",
+            )
+        if now is None:
+            now = page["now"]
+        if not (cursor := page["cursor"]):
+            break
+    return changes, now
+
+
+def queue_stream_changes(changes: dict[int, int]):
+    for id, last_changed in changes.items():
+        game = globals.games.get(id)
+        if game and not game.custom and last_changed > game.last_full_check:
+            stream_pending.add(id)
+
+
+async def stream_changes():
+    # Used in background mode, changes pushed by the Cache API are
+    # queued in stream_pending and refreshed by the gui loop right away
+    since = globals.settings.changes_since
+    retry_delay = 0
+    while True:
+        ids = [game.id for game in globals.games.values() if not game.custom]
+        if ids:
+            try:
+                async with request("POST", api_subscribe_url, json=ids[:api_stream_max_ids], timeout=aiohttp.ClientTimeout(sock_read=api_stream_read_timeout), read=False, cookies=False) as (_, req):
+                    if req.status in (404, 405):
+                        # Older Cache API without change stream, timed refreshes still cover it
+                        return
+                    if req.status == 200:
+                        # Only new changes are pushed, catch up on what happened while disconnected
+                        changes, now = await fetch_changes(since)
+                        queue_stream_changes(changes)
+                        since = now - api_changes_overlap
+                        retry_delay = 0
+                        try:
+                            async for line in req.content:
+                                if not line.startswith(b"data:"):
+                                    continue
+                                changes = {int(id): last_changed for id, last_changed in json.loads(line[5:]).items()}
+                                queue_stream_changes(changes)
+                                since = max(since, max(changes.values()) - api_changes_overlap)
+                        except (aiohttp.ClientError, asyncio.TimeoutError):
+                            pass
+            except Exception:
+                pass
+        retry_delay = min(max(retry_delay * 2, 5), api_stream_retry_max)
+        await asyncio.sleep(retry_delay)
+
+
 async def fast_check(games: list[Game], full=False):
     games = list(filter(lambda game: not game.custom, games))
 
@@ -776,7 +915,8 @@ async def fast_check(games: list[Game], full=False):
         async with fast_checks_sem:
             res = None
             try:
-                res = await fetch("GET", api_fast_check_url.format(ids=",".join(str(game.id) for game in games)), timeout=120, cookies=False)
+                async with request("POST", api_fast_check_url, json=[game.id for game in games], headers={"Accept-Encoding": api_accept_encoding}, timeout=120, cookies=False) as (res, req):
+                    res = api_decode(res, req)
                 raise_api_error(res)
                 last_changes = json.loads(res)
                 raise_api_error(last_changes)
@@ -796,34 +936,22 @@ async def fast_check(games: list[Game], full=False):
     finally:
         fast_checks_counter -= len(games)
 
-    full_queue: list[tuple[Game, int]] = []
+    full_queue: list[tuple[Game, int, str]] = []
     for game in games:
         last_changed = last_changes.get(str(game.id), 0)
         assert last_changed > 0, "Invalid last_changed from fast check API"
-        check_new_enums = False
-        if globals.version != game.last_check_version:
-            check_new_enums = (
-                Tag.unknown in game.tags or
-                game.type is Type.Unknown or
-                game.status is Status.Unknown
-            )
-
-        this_full = full or (
-            check_new_enums or
-            game.status is Status.Unchecked or
-            last_changed > game.last_full_check or
-            (game.image.missing and (game.image_url.startswith("http") or not game.image_url)) or
-            last_check_before("10.1.1", game.last_check_version)  # Switch away from HEAD requests, new version parsing
-        )
+        game_needs_full_data = needs_full_data(game)
+        this_full = full or game_needs_full_data or last_changed > game.last_full_check
         if not this_full:
             globals.refresh_progress += 1
             continue
 
-        full_queue.append((game, last_changed))
+        etag = "" if game_needs_full_data else game.last_full_check_etag
+        full_queue.append((game, last_changed, etag))
 
     tasks: list[asyncio.Task] = []
     try:
-        tasks = [asyncio.create_task(full_check(game, ts)) for game, ts in full_queue]
+        tasks = [asyncio.create_task(full_check(game, ts, etag)) for game, ts, etag in full_queue]
         await asyncio.gather(*tasks)
     except Exception:
         for task in tasks:
@@ -831,11 +959,21 @@ async def fast_check(games: list[Game], full=False):
         raise
 
 
-async def full_check(game: Game, last_changed: int):
+async def full_check(game: Game, last_changed: int, etag: str = ""):
     async with full_checks_counter, full_checks_sem:
 
-        async with request("GET", api_full_check_url.format(id=game.id, ts=last_changed), timeout=globals.settings.request_timeout * 2, cookies=False) as (res, req):
+        headers = {"Accept-Encoding": api_accept_encoding}
+        if etag:
+            headers["If-None-Match"] = etag
+        async with request("GET", api_full_check_url.format(id=game.id, ts=last_changed), headers=headers, timeout=globals.settings.request_timeout * 2, cookies=False) as (res, req):
+            res = api_decode(res, req)
             raise_api_error(res)
+            if req.status == 304:
+                # Nothing changed since the data we already have, but it is checked up to now
+                game.last_full_check = last_changed
+                game.last_check_version = globals.version
+                globals.refresh_progress += 1
+                return
             if req.status in (403, 404):
                 if not game.archived:
                     buttons = {
@@ -861,6 +999,7 @@ async def full_check(game: Game, last_changed: int):
             thread = json.loads(res)
             raise_api_error(thread)
             url = f95_threads_page + str(game.id)
+            last_full_check_etag = req.headers.get("ETag", "")
 
         # Redis only allows string values, so API only gives str for simplicity
         try:
@@ -874,22 +1013,22 @@ async def full_check(game: Game, last_changed: int):
         thread["last_updated"] = int(thread["last_updated"])
         thread["score"] = float(thread["score"])
         thread["votes"] = int(thread["votes"])
-        thread["tags"] = json.loads(thread["tags"])
+        thread["tags"] = api_nested(thread["tags"])
         for i in range(len(thread["tags"])):
             try:
                 thread["tags"][i] = Tag(thread["tags"][i])
             except ValueError:
                 thread["tags"][i] = Tag.unknown
         thread["tags"] = tuple(thread["tags"])
-        thread["unknown_tags"] = json.loads(thread["unknown_tags"])
-        thread["downloads"] = json.loads(thread["downloads"])
+        thread["unknown_tags"] = api_nested(thread["unknown_tags"])
+        thread["downloads"] = api_nested(thread["downloads"])
         for _, links in thread["downloads"]:
             for link_i, link_pair in enumerate(links):
                 links[link_i] = tuple(link_pair)
-        thread["previews_urls"] = json.loads(thread.get("previews_urls", "[]"))
+        thread["previews_urls"] = api_nested(thread.get("previews_urls", "[]"))
         thread["downloads"] = tuple(thread["downloads"])
         thread["reviews_total"] = int(thread.get("reviews_total", "0"))
-        thread["reviews"] = json.loads(thread.get("reviews", "[]"))
+        thread["reviews"] = api_nested(thread.get("reviews", "[]"))
         thread["reviews"] = [Review(**review) for review in thread["reviews"]]
 
         old_name = game.name
@@ -962,6 +1101,7 @@ async def full_check(game: Game, last_changed: int):
             game.url = url
             game.last_updated = thread["last_updated"]
             game.last_full_check = last_full_check
+            game.last_full_check_etag = last_full_check_etag
             game.last_check_version = last_check_version
             game.score = thread["score"]
             game.votes = thread["votes"]
@@ -1366,6 +1506,22 @@ try {{
 
 
 async def refresh(*games: list[Game], full=False, notifs=True, force_archived=False, force_completed=False):
+    refresh_start = time.time()
+    # Between daily full checks, only fast check games the Cache API reports as changed.
+    # The feed only has what the Cache API already rescraped: threads that expired there
+    # without anyone asking are only noticed by its watcher or the next daily full check
+    changes = None
+    if (
+        not games and not full and
+        globals.settings.changes_since and
+        refresh_start - globals.settings.last_full_refresh.value < api_full_refresh_interval
+    ):
+        try:
+            changes, changes_now = await fetch_changes(globals.settings.changes_since)
+        except Exception:
+            # Older Cache API without changes feed or a hiccup, full check covers it anyway
+            changes = None
+
     fast_queue: list[list[Game]] = [[]]
     for game in (games or globals.games.values()):
         if game.custom:
@@ -1376,6 +1532,8 @@ async def refresh(*games: list[Game], full=False, notifs=True, force_archived=Fa
             if not game.image.missing:
                 if game.status is Status.Completed and not globals.settings.refresh_completed_games and not force_completed:
                     continue
+            if changes is not None and game.id not in changes and not needs_full_data(game):
+                continue
         if len(fast_queue[-1]) == api_fast_check_max_ids:
             fast_queue.append([])
         fast_queue[-1].append(game)
@@ -1408,7 +1566,12 @@ async def refresh(*games: list[Game], full=False, notifs=True, force_archived=Fa
 
     if not games:
         globals.settings.last_successful_refresh.update(time.time())
-        await db.update_settings("last_successful_refresh")
+        if changes is None:
+            globals.settings.last_full_refresh.update(refresh_start)
+            globals.settings.changes_since = int(refresh_start) - api_changes_overlap
+        else:
+            globals.settings.changes_since = changes_now - api_changes_overlap
+        await db.update_settings("last_successful_refresh", "last_full_refresh", "changes_since")
 
 
 async def download_file(download: FileDownload):
@@ -194,12 +194,14 @@ async def connect():
             "background_on_close":         f'INTEGER DEFAULT {int(False)}',
             "bg_notifs_interval":          f'INTEGER DEFAULT 15',
             "bg_refresh_interval":         f'INTEGER DEFAULT 30',
+            "bg_stream_changes":           f'INTEGER DEFAULT {int(True)}',
             "browser_custom_arguments":    f'TEXT    DEFAULT ""',
             "browser_custom_executable":   f'TEXT    DEFAULT ""',
             "browser_html":                f'INTEGER DEFAULT {int(False)}',
             "browser_private":             f'INTEGER DEFAULT {int(False)}',
             "browser":                     f'INTEGER DEFAULT {Browser.get(0).hash}',
             "cell_image_ratio":            f'REAL    DEFAULT 3.0',
+            "changes_since":               f'INTEGER DEFAULT 0',
             "check_notifs":                f'INTEGER DEFAULT {int(False)}',
             "compact_timeline":            f'INTEGER DEFAULT {int(False)}',
             "confirm_on_remove":           f'INTEGER DEFAULT {int(True)}',
@@ -223,6 +225,7 @@ async def connect():
             "independent_tab_views":       f'INTEGER DEFAULT {int(False)}',
             "insecure_ssl":                f'INTEGER DEFAULT {int(False)}',
             "interface_scaling":           f'REAL    DEFAULT 1.0',
+            "last_full_refresh":           f'INTEGER DEFAULT 0',
             "last_successful_refresh":     f'INTEGER DEFAULT 0',
             "manual_sort_list":            f'TEXT    DEFAULT "[]"',
             "mark_installed_after_add":    f'INTEGER DEFAULT {int(False)}',
@@ -303,6 +306,7 @@ async def connect():
             "added_on":                    f'INTEGER DEFAULT 0',
             "last_updated":                f'INTEGER DEFAULT 0',
             "last_full_check":             f'INTEGER DEFAULT 0',
+            "last_full_check_etag":        f'TEXT    DEFAULT ""',
             "last_check_version":          f'TEXT    DEFAULT ""',
             "last_launched":               f'INTEGER DEFAULT 0',
             "score":                       f'REAL    DEFAULT 0',
@@ -339,6 +339,7 @@ class MainGUI():
         self.prev_filters: list[Filter] = []
         self.ghost_columns_enabled_count = 0
         self.bg_mode_notifs_timer: float = None
+        self.bg_mode_stream: concurrent.futures.Future = None
         self.sorts: dict[str, list[SortSpec]] = {}
         self.show_games_ids: dict[Tab, list[int]] = {}
 
@@ -817,6 +818,9 @@ class MainGUI():
             self.call_soon.append(self.show)
         self.bg_mode_timer = None
         self.bg_mode_notifs_timer = None
+        if self.bg_mode_stream:
+            self.bg_mode_stream.cancel()
+            self.bg_mode_stream = None
         # if not self.hidden:
         #     glfw.hide_window(self.window)
         glfw.show_window(self.window)
@@ -973,7 +977,7 @@ class MainGUI():
                             text = "Checking for updates..."
                         elif (count := imagehelper.compress_counter) > 0:
                             text = "Compressing images..." if count == 1 else f"Compressing {count} frames..."
-                        elif api.f95_ratelimit._waiters or api.f95_ratelimit_sleeping.count:
+                        elif api.f95_ratelimit.waiting:
                             text = f"Waiting for F95zone ratelimit..."
                         else:
                             text = self.watermark_text
@@ -1034,9 +1038,22 @@ class MainGUI():
                 else:  # Not visible
                     # Unload images if necessary
                     imagehelper.post_draw(0)
+                    # Listen for pushed changes while in bg mode and not paused
+                    if self.hidden and not self.bg_mode_paused and globals.settings.bg_stream_changes:
+                        if not self.bg_mode_stream:
+                            self.bg_mode_stream = async_thread.run(api.stream_changes())
+                    elif self.bg_mode_stream:
+                        self.bg_mode_stream.cancel()
+                        self.bg_mode_stream = None
                     # Tray bg mode and not paused
                     if self.hidden and not self.bg_mode_paused and not utils.is_refreshing():
-                        if not self.bg_mode_timer:
+                        if api.stream_pending:
+                            # Refresh games with pushed changes right away
+                            ids = api.stream_pending.copy()
+                            api.stream_pending.difference_update(ids)
+                            games = [globals.games[id] for id in ids if id in globals.games]
+                            utils.start_refresh_task(api.refresh(*games, notifs=False), reset_bg_timers=False)
+                        elif not self.bg_mode_timer:
                             # Schedule next refresh
                             self.bg_mode_timer = time.time() + globals.settings.bg_refresh_interval * 60
                             self.tray.update_status()
@@ -5073,6 +5090,13 @@ class MainGUI():
             if changed:
                 async_thread.run(db.update_settings("bg_refresh_interval"))
 
+            draw_settings_label(
+                "BG live changes:",
+                "When F95Checker is in background mode it also stays connected to the Cache API, which tells it right "
+                "away when one of your games changes, so it gets refreshed without waiting for the next BG interval."
+            )
+            draw_settings_checkbox("bg_stream_changes")
+
             if not set.check_notifs:
                 imgui.push_disabled()
 
@@ -0,0 +1,117 @@
+import dataclasses
+import enum
+import json
+import pathlib
+import re
+import sys
+import time
+import tracemalloc
+
+from common import parser
+
+# Saved F95zone pages, each with a .json golden of the parsed output next to it.
+# Add a real saved page with --add threads|reviews <file>, it gets scrubbed of the
+# account it was saved with and its golden recorded, or run --update after editing pages.
+# Goldens always come from the reference bs4 parser, fast paths must match them.
+# Pages in synthetic/ are handmade edge cases, they don't stand in for real markup.
+corpus = pathlib.Path(__file__).parent / "bench/parser"
+parsers = {
+    "threads": (parser.thread, parser.thread_fast),
+    "reviews": (parser.reviews,),
+}
+# Whatever ties a saved page to the account that saved it
+scrub_patterns = (
+    (rb'(data-csrf=")[^"]*(")', rb"\1\2"),
+    (rb'(name="_xfToken" value=")[^"]*(")', rb"\1\2"),
+    (rb"(csrf: ')[^']*(')", rb"\1\2"),
+    (rb"(_xfToken=)[^&\"'\s]*", rb"\1"),
+    (rb'(<a [^>]*p-navgroup-link--user[^>]*>).*?(</a>)', rb"\1\2"),
+)
+
+
+def add(kind: str, file: pathlib.Path):
+    res = file.read_bytes()
+    for pattern, replacement in scrub_patterns:
+        res = re.sub(pattern, replacement, res, flags=re.DOTALL)
+    page = corpus / kind / file.with_suffix(".html").name
+    page.write_bytes(res)
+    parsed = to_json(parsers[kind][0](res))
+    page.with_suffix(".json").write_text(json.dumps(parsed, indent=4, ensure_ascii=False) + "\n", "utf-8")
+    print(f"Added {page.relative_to(corpus)}, check the golden and the page for personal details")
+
+
+def to_json(value):
+    if isinstance(value, parser.ParserError):
+        return {"error": value.message}
+    if dataclasses.is_dataclass(value):
+        return {field.name: to_json(getattr(value, field.name)) for field in dataclasses.fields(value)}
+    if isinstance(value, enum.Enum):
+        return value.name
+    if isinstance(value, (list, tuple)):
+        return [to_json(item) for item in value]
+    return value
+
+
+def bench(func, res: bytes, rounds: int):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        parsed = func(res)
+    elapsed = (time.perf_counter() - start) / rounds
+    # Separate run, tracemalloc slows everything down
+    tracemalloc.start()
+    func(res)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return parsed, elapsed, peak
+
+
+def main():
+    if "--add" in sys.argv:
+        kind, file = sys.argv[sys.argv.index("--add") + 1 : sys.argv.index("--add") + 3]
+        add(kind, pathlib.Path(file))
+    update = "--update" in sys.argv
+    rounds = int(sys.argv[sys.argv.index("--rounds") + 1]) if "--rounds" in sys.argv else 5
+
+    failed = []
+    totals = {}
+    real = 0
+    print(f"{'page':<40} {'parser':<12} {'ms':>8} {'peak KiB':>10}")
+    for kind, funcs in parsers.items():
+        for page in sorted((corpus / kind).rglob("*.html")):
+            name = page.relative_to(corpus).with_suffix("").as_posix()
+            real += "synthetic" not in page.relative_to(corpus).parts
+            res = page.read_bytes()
+            golden = page.with_suffix(".json")
+            expected = json.loads(golden.read_text("utf-8")) if golden.exists() else None
+            for func in funcs:
+                parsed, elapsed, peak = bench(func, res, rounds)
+                parsed = to_json(parsed)
+                print(f"{name:<40} {func.__name__:<12} {elapsed * 1000:>8.2f} {peak / 1024:>10.0f}")
+                count, seconds, size = totals.get(func.__name__, (0, 0.0, 0))
+                totals[func.__name__] = (count + 1, seconds + elapsed, size + len(res))
+                if update and func is funcs[0]:
+                    golden.write_text(json.dumps(parsed, indent=4, ensure_ascii=False) + "\n", "utf-8")
+                    expected = parsed
+                if parsed != expected:
+                    failed.append(f"{name} ({func.__name__})")
+
+    print()
+    for name, (count, seconds, size) in totals.items():
+        print(f"{name}: {count} pages, {count / seconds:.1f} pages/s, {size / seconds / 1024 / 1024:.2f} MiB/s")
+    if not real:
+        print()
+        print("Only synthetic pages in the corpus, real F95zone markup is not covered, see --add")
+
+    if failed:
+        print()
+        print("Output differs from golden:")
+        for page in failed:
+            print(f"  - {page}")
+        sys.exit(1)
+    else:
+        print("All outputs match their goldens!")
+        sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()